@@ -0,0 +1,202 @@
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+import tree
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import video_index.app as a
+import video_index.metrics as mx
+import video_index.models as m
+import video_index.tasks as ta
+import video_index.templates as te
+import video_index.writer as w
+
+repo = pathlib.Path(__file__).parent.parent
+
+
+def _commit() -> str:
+    def git(*args: str) -> str:
+        return subprocess.run(  # noqa: S603
+            ["git", *args],  # noqa: S607
+            capture_output=True,
+            check=False,
+            cwd=repo,
+            text=True,
+        ).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    if git("status", "--porcelain", "--untracked-files=no"):
+        commit = f"{commit}-dirty"
+    return commit
+
+
+def _time(fn: typing.Callable[[], object], repeat: int) -> dict[str, float]:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "min_ms": samples[0],
+        "median_ms": statistics.median(samples),
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+def _scan(root: pathlib.Path, quick: bool) -> dict[str, float]:
+    start = time.perf_counter()
+    ta.scan_location(root, quick)
+    seconds = time.perf_counter() - start
+    file_count = m.get_model().locations_get(root).file_count
+    return {"seconds": seconds, "files_per_second": file_count / seconds}
+
+
+def run(args: argparse.Namespace, workdir: pathlib.Path) -> dict[str, dict]:
+    results = {}
+    suffix_mix = tree.parse_suffix_mix(args.suffix_mix)
+    if args.tree:
+        root = args.tree.resolve()
+    else:
+        root = workdir / "media"
+        start = time.perf_counter()
+        tree.make_tree(
+            root,
+            args.files,
+            args.depth,
+            args.fan_out,
+            suffix_mix,
+            args.max_size,
+            args.seed,
+        )
+        results["generate tree"] = {"seconds": time.perf_counter() - start}
+
+    # get_model opens .local/video-index.db below the working directory
+    os.chdir(workdir)
+    (workdir / ".local").mkdir()
+    model = m.get_model()
+    model.migrate()
+    w.submit(w.INTERACTIVE, m.VideoIndexModel.locations_add, str(root)).result()
+    results["scan"] = _scan(root, quick=False)
+    results["quick scan"] = _scan(root, quick=True)
+
+    for suffix in suffix_mix:
+        w.submit(
+            w.INTERACTIVE, m.VideoIndexModel.suffixes_enable, suffix, True
+        ).result()
+    # Every tenth file gets notes, so the missing notes filter skips some rows
+    model.u("update files set notes = 'bench' where file_key % 10 = 0")
+    file_count = model.locations_get(root).file_count
+    middle = model.q_val(
+        "select file_path from files order by file_path limit 1 offset :offset",
+        {"offset": file_count // 2},
+    )
+    for after in ("", middle):
+        for missing_notes_only in (False, True):
+            # A word matches many files and a number matches one
+            for label, q in (
+                ("none", None),
+                ("word", tree.words[0]),
+                ("number", f"{file_count // 2:07d}"),
+            ):
+                name = (
+                    f"files_list after={'middle' if after else 'start'} "
+                    f"missing_notes_only={missing_notes_only} q={label}"
+                )
+                results[name] = _time(
+                    lambda after=after, n=missing_notes_only, q=q: model.files_list(
+                        after, n, q
+                    ),
+                    args.repeat,
+                )
+    results["suffixes_count"] = _time(model.suffixes_count, args.repeat)
+    with a.app.test_request_context():
+        files = model.files_list()
+        results["templates.files_list"] = _time(
+            lambda: te.files_list(files), args.repeat
+        )
+    return results
+
+
+def compare(previous: dict, current: dict) -> None:
+    print(f"{'':60} {previous['commit']:>14} {current['commit']:>14}")
+    for name, result in current["results"].items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        key = "median_ms" if "median_ms" in result else "seconds"
+        change = (result[key] - before[key]) / before[key] * 100 if before[key] else 0
+        print(
+            f"{name:60} {before[key]:>14.3f} {result[key]:>14.3f} {change:>+7.1f}% "
+            f"{key}"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark scanning, queries and rendering on a synthetic tree"
+    )
+    tree.add_arguments(parser)
+    parser.add_argument(
+        "--tree",
+        type=pathlib.Path,
+        help="scan this existing tree instead of generating one",
+    )
+    parser.add_argument("--repeat", default=50, type=int)
+    parser.add_argument(
+        "--output",
+        type=pathlib.Path,
+        help="where to write the results, defaults to .local/bench/<commit>.json",
+    )
+    parser.add_argument(
+        "--compare", type=pathlib.Path, help="results of an earlier run to compare to"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    mx.slow_query_seconds = math.inf
+    commit = _commit()
+    output = (args.output or repo / ".local" / "bench" / f"{commit}.json").resolve()
+    previous = json.loads(args.compare.read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = pathlib.Path.cwd()
+        try:
+            results = run(args, pathlib.Path(tmp))
+        finally:
+            os.chdir(cwd)
+    current = {
+        "commit": commit,
+        "created_at": datetime.datetime.now(datetime.UTC).isoformat(),
+        "python": sys.version,
+        "parameters": {
+            k: str(v) if isinstance(v, pathlib.Path) else v
+            for k, v in vars(args).items()
+            if k not in ("compare", "output")
+        },
+        "results": results,
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(current, indent=2), newline="\n")
+    for name, result in results.items():
+        print(f"{name:60} " + " ".join(f"{k}={v:.3f}" for k, v in result.items()))
+    print(f"Wrote {output}")
+    if previous:
+        compare(previous, current)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
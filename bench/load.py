@@ -0,0 +1,359 @@
+import argparse
+import collections
+import datetime
+import html
+import http.client
+import json
+import logging
+import os
+import pathlib
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import tree
+import waitress
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import video_index.app as a
+import video_index.models as m
+import video_index.tasks as ta
+import video_index.writer as w
+
+default_mix = "scroll=4,search=3,notes=1,range=2"
+default_suffix_mix = ".mkv=4,.mp4=4"
+max_scroll_pages = 10
+range_size = 1024 * 1024
+# File ids seen in card responses, the most recent are picked from
+max_file_ids = 10000
+
+file_id_pattern = re.compile(r'hx-get="/files/player/([^"]+)"')
+cursor_pattern = re.compile(r'hx-post="(/files/cards\?after=[^"]*)"')
+
+
+def serve(args: argparse.Namespace) -> None:
+    # Runs in the server process, which owns the database in the work folder
+    logging.basicConfig(level=logging.WARNING)
+    workdir = args.workdir.resolve()
+    root = workdir / "media"
+    if not root.exists():
+        tree.make_tree(
+            root,
+            args.files,
+            args.depth,
+            args.fan_out,
+            tree.parse_suffix_mix(args.suffix_mix),
+            args.max_size,
+            args.seed,
+        )
+    os.chdir(workdir)
+    pathlib.Path(".local").mkdir(exist_ok=True)
+    model = m.get_model()
+    model.migrate()
+    w.submit(w.INTERACTIVE, m.VideoIndexModel.locations_add, str(root)).result()
+    if model.locations_get(root).file_count == 0:
+        ta.scan_location(root)
+    for suffix in tree.parse_suffix_mix(args.suffix_mix):
+        w.submit(
+            w.INTERACTIVE, m.VideoIndexModel.suffixes_enable, suffix, True
+        ).result()
+    ta.scheduler.start()
+    waitress.serve(
+        a.app, host="127.0.0.1", ident=None, port=args.serve_port, threads=args.threads
+    )
+
+
+class Results:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.defaultdict(collections.Counter)
+
+    def record(self, label: str, seconds: float, status: int | None) -> None:
+        with self._lock:
+            self.latencies[label].append(seconds * 1000)
+            if status is None or status >= 400:
+                self.errors[label][str(status)] += 1
+
+    def summary(self, duration: float) -> dict[str, dict]:
+        summary = {}
+        for label, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            errors = sum(self.errors[label].values())
+
+            def percentile(p: float, samples: list[float] = samples) -> float:
+                return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+            summary[label] = {
+                "requests": len(samples),
+                "requests_per_second": len(samples) / duration,
+                "error_rate": errors / len(samples),
+                "errors": dict(self.errors[label]),
+                "p50_ms": percentile(0.5),
+                "p95_ms": percentile(0.95),
+                "p99_ms": percentile(0.99),
+            }
+        return summary
+
+
+class Client:
+    # One keep-alive connection, like a browser tab
+    def __init__(
+        self, port: int, results: Results, file_ids: collections.deque[str]
+    ) -> None:
+        self.cnx = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.results = results
+        self.file_ids = file_ids
+
+    def request(
+        self,
+        label: str,
+        method: str,
+        path: str,
+        form: dict[str, str] | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> str | None:
+        headers = dict(headers or {})
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        start = time.perf_counter()
+        try:
+            self.cnx.request(method, path, body, headers)
+            response = self.cnx.getresponse()
+            data = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self.cnx.close()
+            data = b""
+            status = None
+        self.results.record(label, time.perf_counter() - start, status)
+        if status is None or status >= 400:
+            return None
+        return data.decode(errors="replace")
+
+    def cards(self, label: str, path: str, form: dict[str, str]) -> str | None:
+        body = self.request(label, "POST", path, form)
+        if body:
+            self.file_ids.extend(file_id_pattern.findall(body))
+        return body
+
+    def scroll(self, rng: random.Random) -> None:
+        # Follows the cursor in the revealed sentinel, like infinite scroll does
+        path = "/files/cards"
+        for _ in range(rng.randint(1, max_scroll_pages)):
+            body = self.cards("scroll /files/cards", path, {})
+            cursor = cursor_pattern.search(body or "")
+            if cursor is None:
+                break
+            path = html.unescape(cursor.group(1))
+
+    def search(self, rng: random.Random) -> None:
+        # One request per keystroke once the word is long enough to search for
+        word = rng.choice(tree.words)
+        for i in range(2, len(word) + 1):
+            self.cards("search /files/cards", "/files/cards", {"q": word[:i]})
+
+    def notes(self, rng: random.Random) -> None:
+        if not self.file_ids:
+            return
+        file_id = rng.choice(self.file_ids)
+        self.request(
+            "notes /files/update-notes",
+            "POST",
+            "/files/update-notes",
+            {"file-id": file_id, "notes": f"Load test {rng.random():.6f}"},
+        )
+
+    def range(self, rng: random.Random) -> None:
+        # A player reads the start of a file, then seeks to the end for the index
+        if not self.file_ids:
+            return
+        path = f"/files/get/{rng.choice(self.file_ids)}"
+        for value in (f"bytes=0-{range_size - 1}", f"bytes=-{range_size}"):
+            self.request("range /files/get", "GET", path, headers={"Range": value})
+
+
+def _run_client(
+    client: Client, mix: dict[str, int], deadline: float, seed: int
+) -> None:
+    rng = random.Random(seed)  # noqa: S311
+    scenarios = [getattr(client, name) for name in mix]
+    weights = list(mix.values())
+    while time.monotonic() < deadline:
+        rng.choices(scenarios, weights)[0](rng)
+
+
+def _run_scans(
+    client: Client, root: pathlib.Path, interval: float, deadline: float
+) -> None:
+    # Requests are coalesced by the app, so this keeps one scan running at a time
+    while time.monotonic() < deadline:
+        client.request(
+            "scan /locations/scan",
+            "POST",
+            "/locations/scan",
+            {"root-folder": str(root)},
+        )
+        time.sleep(interval)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(port: int, server: subprocess.Popen, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+
+def run(args: argparse.Namespace, workdir: pathlib.Path) -> int:
+    mix = {k: int(v) for k, _, v in (i.partition("=") for i in args.mix.split(","))}
+    port = _free_port()
+    log_path = workdir / "server.log"
+    command = [
+        sys.executable,
+        __file__,
+        *sys.argv[1:],
+        "--workdir",
+        str(workdir),
+        "--serve-port",
+        str(port),
+    ]
+    print(f"Seeding {args.files} files and starting the server on port {port}")
+    with log_path.open("w") as log_file:
+        server = subprocess.Popen(command, stderr=log_file, stdout=log_file)  # noqa: S603
+    try:
+        if not _wait_for_server(port, server, args.startup_timeout):
+            print(log_path.read_text()[-4000:])
+            print("The server did not start")
+            return 1
+        results = Results()
+        file_ids = collections.deque(maxlen=max_file_ids)
+        deadline = time.monotonic() + args.duration
+        threads = [
+            threading.Thread(
+                target=_run_client,
+                args=[Client(port, results, file_ids), mix, deadline, args.seed + i],
+            )
+            for i in range(args.clients)
+        ]
+        if args.scan_interval:
+            threads.append(
+                threading.Thread(
+                    target=_run_scans,
+                    args=[
+                        Client(port, results, file_ids),
+                        workdir / "media",
+                        args.scan_interval,
+                        deadline,
+                    ],
+                )
+            )
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        duration = time.monotonic() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    summary = results.summary(duration)
+    slow_queries = log_path.read_text().count("Slow query in")
+    print(
+        f"{'':28} {'requests':>9} {'req/s':>8} {'errors':>7} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    )
+    for label, s in summary.items():
+        print(
+            f"{label:28} {s['requests']:>9} {s['requests_per_second']:>8.1f} "
+            f"{s['error_rate']:>7.1%} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+            f"{s['p99_ms']:>9.1f}"
+        )
+    print(f"{slow_queries} slow queries were logged to {log_path}")
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(
+            json.dumps(
+                {
+                    "created_at": datetime.datetime.now(datetime.UTC).isoformat(),
+                    "parameters": {
+                        k: str(v) if isinstance(v, pathlib.Path) else v
+                        for k, v in vars(args).items()
+                        if k not in ("output", "serve_port", "workdir")
+                    },
+                    "results": summary,
+                    "slow_queries": slow_queries,
+                },
+                indent=2,
+            ),
+            newline="\n",
+        )
+        print(f"Wrote {args.output}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Load test the app under waitress against a seeded database"
+    )
+    tree.add_arguments(parser)
+    parser.set_defaults(
+        files=20000, max_size=256 * 1024**2, suffix_mix=default_suffix_mix
+    )
+    parser.add_argument("--threads", default=8, type=int, help="waitress threads")
+    parser.add_argument("--clients", default=16, type=int)
+    parser.add_argument("--duration", default=30.0, type=float, help="seconds")
+    parser.add_argument(
+        "--mix",
+        default=default_mix,
+        help="comma-separated scenarios with relative weights, from "
+        "scroll, search, notes and range",
+    )
+    parser.add_argument(
+        "--scan-interval",
+        default=5.0,
+        type=float,
+        help="seconds between scan requests during the run, 0 for no scans",
+    )
+    parser.add_argument("--startup-timeout", default=600.0, type=float)
+    parser.add_argument(
+        "--workdir",
+        type=pathlib.Path,
+        help="keep the tree, database and server log here to reuse them",
+    )
+    parser.add_argument("--output", type=pathlib.Path)
+    parser.add_argument("--serve-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve_port:
+        serve(args)
+        return 0
+    if args.workdir:
+        args.workdir.mkdir(parents=True, exist_ok=True)
+        return run(args, args.workdir.resolve())
+    with tempfile.TemporaryDirectory() as tmp:
+        return run(args, pathlib.Path(tmp))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
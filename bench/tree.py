@@ -0,0 +1,120 @@
+import argparse
+import pathlib
+import random
+import time
+
+words = [
+    "alpha",
+    "bravo",
+    "charlie",
+    "delta",
+    "echo",
+    "foxtrot",
+    "golf",
+    "hotel",
+    "india",
+    "juliett",
+    "kilo",
+    "lima",
+    "mike",
+    "november",
+    "oscar",
+    "papa",
+    "quebec",
+    "romeo",
+    "sierra",
+    "tango",
+    "uniform",
+    "victor",
+    "whiskey",
+    "xray",
+    "yankee",
+    "zulu",
+]
+default_suffix_mix = ".mkv=4,.mp4=4,.avi=1,.srt=1"
+
+
+def parse_suffix_mix(value: str) -> dict[str, int]:
+    mix = {}
+    for item in value.split(","):
+        suffix, _, weight = item.partition("=")
+        mix[suffix.strip()] = int(weight or "1")
+    return mix
+
+
+def leaf_folders(root: pathlib.Path, depth: int, fan_out: int) -> list[pathlib.Path]:
+    folders = [root]
+    for level in range(depth):
+        folders = [
+            f / f"{words[i % len(words)]}-{level}{i:03d}"
+            for f in folders
+            for i in range(fan_out)
+        ]
+    return folders
+
+
+def make_tree(
+    root: pathlib.Path,
+    files: int,
+    depth: int = 3,
+    fan_out: int = 10,
+    suffix_mix: dict[str, int] | None = None,
+    max_size: int = 0,
+    seed: int = 0,
+) -> None:
+    # Files are spread evenly over the leaf folders and named from a small vocabulary,
+    # so searches for a word match many files and searches for a number match one.
+    # Sizes are set with truncate, which leaves sparse files that use no disk space.
+    rng = random.Random(seed)  # noqa: S311
+    suffix_mix = suffix_mix or parse_suffix_mix(default_suffix_mix)
+    suffixes = list(suffix_mix)
+    weights = list(suffix_mix.values())
+    leaves = leaf_folders(root, depth, fan_out)
+    for folder in leaves:
+        folder.mkdir(parents=True, exist_ok=True)
+    for i in range(files):
+        suffix = rng.choices(suffixes, weights)[0]
+        name = f"{rng.choice(words)} {rng.choice(words)} {i:07d}{suffix}"
+        with (leaves[i % len(leaves)] / name).open("wb") as f:
+            if max_size:
+                f.truncate(rng.randrange(max_size))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--files", default=100000, type=int)
+    parser.add_argument("--depth", default=3, type=int)
+    parser.add_argument("--fan-out", default=10, type=int)
+    parser.add_argument(
+        "--suffix-mix",
+        default=default_suffix_mix,
+        help="comma-separated suffixes with relative weights",
+    )
+    parser.add_argument(
+        "--max-size",
+        default=4 * 1024**3,
+        type=int,
+        help="files get random sparse sizes below this, 0 leaves them empty",
+    )
+    parser.add_argument("--seed", default=0, type=int)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic media tree")
+    parser.add_argument("root", type=pathlib.Path)
+    add_arguments(parser)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    make_tree(
+        args.root,
+        args.files,
+        args.depth,
+        args.fan_out,
+        parse_suffix_mix(args.suffix_mix),
+        args.max_size,
+        args.seed,
+    )
+    print(f"Generated {args.files} files in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import inspect
+import pathlib
+import re
+import sys
+import tempfile
+import typing
+
+import fort
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import video_index.models as m
+
+# Tables that stay small no matter how many files are indexed
+small_tables = {"locations", "schema_versions", "sqlite_master", "suffixes"}
+
+# Methods that run DDL or are otherwise not worth checking
+skipped_methods = {"migrate"}
+
+# Full scans that are known and accepted, keyed by method name
+allowed_full_scans = {
+    # Reads the partial index that only holds unfinished scans
+    "scans_resumable": {"scans"},
+}
+
+statements = ("delete", "insert", "select", "update", "with")
+keywords = {"join", "left", "on", "order", "group", "limit", "set", "where", "select"}
+table_alias = re.compile(r"\b(?:from|join|update|into)\s+(\w+)(?:\s+(?:as\s+)?(\w+))?")
+
+
+def _aliases(sql: str) -> dict[str, str]:
+    aliases = {}
+    for table, alias in table_alias.findall(sql.lower()):
+        aliases[table] = table
+        if alias and alias not in keywords:
+            aliases[alias] = table
+    return aliases
+
+
+class PlanCheckingModel(m.VideoIndexModel):
+    def __init__(self, dsn: str) -> None:
+        self.method = None
+        self.checked = set()
+        self.failures = []
+        super().__init__(dsn)
+
+    def _check(self, sql: str, params: dict | None) -> None:
+        if self.method is None:
+            return
+        if not sql.lstrip().lower().startswith(statements):
+            return
+        self.checked.add(self.method)
+        tables = {
+            row["name"]
+            for row in self.cnx.execute(
+                "select name from sqlite_master where type = 'table'"
+            )
+        }
+        aliases = _aliases(sql)
+        allowed = allowed_full_scans.get(self.method, set())
+        for row in self.cnx.execute(f"explain query plan {sql}", params or {}):
+            detail = row["detail"]
+            match = re.match(r"SCAN (\w+)", detail)
+            if match is None or "VIRTUAL TABLE" in detail:
+                continue
+            table = aliases.get(match.group(1).lower(), match.group(1).lower())
+            if table not in tables or table in small_tables or table in allowed:
+                continue
+            self.failures.append((self.method, detail, sql))
+
+    def _q_gen(self, sql: str, params: dict | None = None) -> typing.Iterator[dict]:
+        self._check(sql, params)
+        yield from super()._q_gen(sql, params)
+
+    def b(self, sql: str, params: list[dict]) -> None:
+        if params:
+            self._check(sql, params[0])
+        super().b(sql, params)
+
+    def u(self, sql: str, params: dict | None = None) -> int:
+        self._check(sql, params)
+        return super().u(sql, params)
+
+
+def _exercise(model: PlanCheckingModel, root: pathlib.Path) -> None:
+    file_path = root / "show" / "episode.mkv"
+    folder = m.Folder(str(file_path.parent), 0, 1)
+
+    model.method = "locations_add"
+    model.locations_add(str(root))
+    model.method = "locations_get"
+    model.locations_get(root)
+    model.method = "locations_list"
+    model.locations_list()
+    model.method = "locations_scan_start"
+    scan_id = model.locations_scan_start(root)
+    model.method = "locations_scan_flush"
+    scanned_file = m.ScannedFile(str(file_path), 1, 2, 1000, 0)
+    movie_file = m.ScannedFile(str(root / "movie.mp4"), 1, 3, 2000, 0)
+    model.locations_scan_flush(
+        scan_id,
+        [scanned_file, movie_file],
+        [folder],
+        [folder.folder_path],
+        [str(root)],
+    )
+    model.method = "scans_resumable"
+    model.scans_resumable()
+    model.method = "folders_list"
+    model.folders_list(root)
+    model.method = "suffixes_enable"
+    model.suffixes_enable(".mkv", True)
+    model.method = "suffixes_count"
+    model.suffixes_count()
+    model.method = "files_list"
+    # A limit of 0 treats every search as common, so both search plans are checked
+    for m.search_sort_limit in (m.search_sort_limit, 0):
+        for after in ("", str(file_path)):
+            for missing_notes_only in (False, True):
+                for q in (None, "episode"):
+                    model.files_list(after, missing_notes_only, q)
+    model.method = None
+    file_id = model.q_val("select id from files limit 1")
+    model.method = "files_get"
+    model.files_get(file_id)
+    model.method = "files_update_notes"
+    model.files_update_notes(file_id, "Notes")
+    model.method = "files_probe_candidates"
+    model.files_probe_candidates(root, {".mkv", ".mp4"}, "", 100)
+    model.method = "files_update_metadata"
+    model.files_update_metadata(
+        [
+            {
+                "file_path": str(file_path),
+                "duration": 60.0,
+                "width": 1920,
+                "height": 1080,
+                "video_codec": "H.264",
+                "bitrate": 1000000,
+                "probe_size": 7500000,
+                "probe_mtime_ns": 0,
+            }
+        ]
+    )
+    model.method = "files_partial_hash_candidates"
+    model.files_partial_hash_candidates(root)
+    model.method = "files_content_hash_candidates"
+    model.files_content_hash_candidates(root)
+    model.method = "files_update_hashes"
+    model.files_update_hashes(
+        [{"file_path": str(file_path), "partial_hash": "ab", "content_hash": "cd"}]
+    )
+    model.method = "files_duplicates"
+    for after in ("", "cd"):
+        model.files_duplicates(after)
+    model.method = "locations_scan_complete"
+    model.locations_scan_complete(root, scan_id)
+    # Finding the same file under a new name checks the move reconciliation
+    model.method = None
+    scan_id = model.locations_scan_start(root)
+    renamed_file = scanned_file._replace(file_path=str(root / "episode.mkv"))
+    model.locations_scan_flush(scan_id, [renamed_file], [], [])
+    model.method = "locations_scan_complete"
+    model.locations_scan_complete(root, scan_id)
+    model.method = "locations_sync"
+    moved_file = renamed_file._replace(file_path=str(root / "moved.mkv"))
+    model.locations_sync(
+        root, [moved_file], [m.Folder(str(root), 0, 1)], [folder.folder_path]
+    )
+    model.method = "locations_watch"
+    model.locations_watch(root, True)
+    model.method = "locations_schedule"
+    model.locations_schedule(root, 1440)
+    model.method = "locations_scan_cancel"
+    model.locations_scan_cancel(root, model.locations_scan_start(root))
+    model.method = None
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        model = PlanCheckingModel(str(pathlib.Path(tmp) / "video-index.db"))
+        model.migrate()
+        _exercise(model, pathlib.Path(tmp) / "media")
+        model.cnx.close()
+    methods = {
+        name
+        for name, _ in inspect.getmembers(m.VideoIndexModel, inspect.isfunction)
+        if not name.startswith("_") and not hasattr(fort.SQLiteDatabase, name)
+    }
+    unchecked = methods - skipped_methods - model.checked
+    for name in sorted(unchecked):
+        print(f"{name}: no queries checked, add it to _exercise")
+    for method, detail, sql in model.failures:
+        print(f"{method}: {detail}")
+        print(sql)
+    if unchecked or model.failures:
+        return 1
+    print(f"Checked query plans for {len(model.checked)} methods")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+import datetime
+import itertools
+import pathlib
+import sys
+
+import flask
+import htpy
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import video_index.app as a
+import video_index.models as m
+import video_index.templates as te
+
+# The precompiled fragments in templates must render exactly what htpy renders
+fast_card = te._card
+fast_page = te._page
+
+file_paths = [
+    "/media/Show/Season 1/Episode 1.mkv",
+    "/media/A & B/<tag> \"double\" 'single'.mp4",
+    "/media/ünïcödé/файл.mkv",
+    "/movie.mp4",
+    "/media/__fragment_name__/{braces} %s.mkv",
+]
+file_ids = ["Ab3_x-Yz9Q0", "needs quoting/ü"]
+notes = ["", "Plain notes", "<b>bold</b> & \"double\" 'single'", "multi\nline"]
+metadata = [
+    (None, None, None, None, None),
+    (3725.4, 1920, 1080, "H.264", 8000000),
+    (59.6, None, None, None, None),
+    (None, 1280, None, "<codec> & co", None),
+    (None, None, None, None, 1500),
+]
+
+
+def _files() -> list[m.File]:
+    return [
+        m.File(pathlib.Path(file_path), file_id, note, *values)
+        for file_path, file_id, note, values in itertools.product(
+            file_paths, file_ids, notes, metadata
+        )
+    ]
+
+
+def _reference_files_list(files: list[m.File]) -> str:
+    # files_list as it was before cards were rendered from fragments
+    if len(files) < 1:
+        return str(
+            htpy.div(".col.pb-3")[
+                "No files found. Adjust your filters or scan a ",
+                htpy.a(href=flask.url_for("locations"))["location"],
+                " and enable a ",
+                htpy.a(href=flask.url_for("suffixes"))["suffix"],
+                " first.",
+            ]
+        )
+
+    cards = []
+    last_path = ""
+    for i, f in enumerate(files):
+        if i < 5:
+            cards.append(f.card)
+            last_path = f.file_path
+        else:
+            cards.append(
+                htpy.div(
+                    ".col.pb-3",
+                    hx_include="#card-filters",
+                    hx_post=flask.url_for("files_cards", after=last_path),
+                    hx_swap="outerHTML",
+                    hx_trigger="revealed",
+                )
+            )
+    return str(htpy.fragment[cards])
+
+
+def _reference_page(active_page: str, content: htpy.Node) -> str:
+    return str(te._base([te._nav(active_page), content]))
+
+
+def _pages() -> list[tuple[str, str]]:
+    now = datetime.datetime(2025, 1, 2, 3, 4, 5, tzinfo=datetime.UTC)
+    locs = [
+        m.Location(pathlib.Path("/media/A & B"), now, None, 12, True, 60),
+        m.Location(pathlib.Path("/media/other"), None, None, 0),
+    ]
+    suffix_counts = [m.SuffixCount(".mkv", 3, True), m.SuffixCount(".<x>", 1, False)]
+    return [
+        ("duplicates", te.duplicates()),
+        ("index", te.index()),
+        ("locations", te.locations(locs)),
+        ("locations empty", te.locations([])),
+        ("suffixes", te.suffixes(suffix_counts)),
+        ("suffixes empty", te.suffixes([])),
+    ]
+
+
+def _check() -> list[str]:
+    failures = []
+    files = _files()
+    # Twice, so both building and reusing the cached fragments are checked
+    for _ in range(2):
+        failures.extend(
+            f"card {f.file_path} {f.id!r} {f.notes!r}"
+            for f in files
+            if fast_card(f) != str(f.card)
+        )
+        failures.extend(
+            f"files_list with {n} files"
+            for n in (0, 1, 5, 6)
+            if te.files_list(files[:n]) != _reference_files_list(files[:n])
+        )
+        fast = _pages()
+        te._page = _reference_page
+        try:
+            reference = _pages()
+        finally:
+            te._page = fast_page
+        failures.extend(
+            f"page {name}"
+            for (name, html), (_, expected) in zip(fast, reference, strict=True)
+            if html != expected
+        )
+    return failures
+
+
+def main() -> int:
+    failures = []
+    page_count = 0
+    # The script root is part of every URL, so check an app mounted below a path too
+    for base_url in ("http://localhost/", "http://localhost/mounted/"):
+        with a.app.test_request_context("/", base_url=base_url):
+            failures.extend(f"{base_url}: {f}" for f in _check())
+            page_count = len(_pages())
+    for failure in failures:
+        print(f"Rendering differs from htpy: {failure}")
+    if failures:
+        return 1
+    print(f"Checked rendering of {len(_files())} cards and {page_count} pages")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
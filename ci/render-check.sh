@@ -0,0 +1,2 @@
+pip install uv
+uv run ci/render-check.py
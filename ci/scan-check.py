@@ -0,0 +1,98 @@
+import os
+import pathlib
+import sys
+import tempfile
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import video_index.models as m
+import video_index.tasks as ta
+
+real_walk = ta.walk
+
+
+def _files(root: pathlib.Path) -> set[str]:
+    sql = """
+        select file_path
+        from files
+        where file_path >= :path_lo and file_path < :path_hi
+    """
+    return {row["file_path"] for row in m.get_model().q(sql, m._path_range(root))}
+
+
+def _interrupt(folder: pathlib.Path, stop: str) -> None:
+    # Stops the next scan right after the listing of folder is flushed
+    def walk(root_folder: pathlib.Path, *args: object, **kwargs: object) -> object:
+        for listing in real_walk(root_folder, *args, **kwargs):
+            yield listing
+            if listing.folder.folder_path == str(folder):
+                if stop == "cancel":
+                    ta.cancel_scan(root_folder)
+                else:
+                    raise RuntimeError("Scan interrupted")
+
+    ta.walk = walk
+
+
+def _check_interrupted(tmp: pathlib.Path, stop: str) -> list[str]:
+    root = tmp / stop
+    folder = root / "F"
+    folder.mkdir(parents=True)
+    for name in ("x.mkv", "y.mkv"):
+        (folder / name).write_bytes(name.encode())
+    (root / "G").mkdir()
+    m.get_model().locations_add(str(root))
+    ta.scan_location(root)
+    (folder / "x.mkv").unlink()
+    _interrupt(folder, stop)
+    try:
+        ta.scan_location(root, chunk_size=1)
+    except RuntimeError:
+        pass
+    finally:
+        ta.walk = real_walk
+    failures = []
+    for n in range(2):
+        ta.scan_location(root, quick=True)
+        if str(folder / "x.mkv") in _files(root):
+            failures.append(
+                f"{stop}: deleted file is still indexed after {n + 1} scans"
+            )
+    return failures
+
+
+def _check_vanished(tmp: pathlib.Path) -> list[str]:
+    failures = []
+    not_a_folder = tmp / "file"
+    not_a_folder.touch()
+    for folder in (tmp / "missing", not_a_folder):
+        listing = ta.list_folder(str(folder), None, [])
+        if not listing.changed or listing.files or listing.folders:
+            failures.append(f"{folder.name}: listing is not empty and changed")
+    return failures
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        os.chdir(tmp)
+        (tmp / ".local").mkdir()
+        m.get_model().migrate()
+        # Only the listing is checked, so files are neither probed nor hashed
+        ta.probe_location = ta.hash_location = lambda root_folder: None
+        failures = [
+            *_check_interrupted(tmp, "cancel"),
+            *_check_interrupted(tmp, "raise"),
+            *_check_vanished(tmp),
+        ]
+        m.get_model().cnx.close()
+    for failure in failures:
+        print(f"Scan check failed: {failure}")
+    if failures:
+        return 1
+    print("Checked cancelled, interrupted and vanished scans")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
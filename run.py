@@ -1,3 +1,6 @@
+import argparse
+import os
+
 import notch
 
 import video_index.app
@@ -5,4 +8,13 @@ import video_index.app
 notch.configure()
 
 if __name__ == "__main__":
-    video_index.app.main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--server",
+        choices=["waitress", "async"],
+        default=os.environ.get("SERVER", "waitress"),
+        help="waitress serves everything from a thread pool; async streams video "
+        "files from an event loop and runs the other routes on a thread pool",
+    )
+    args = parser.parse_args()
+    video_index.app.main(server=args.server)
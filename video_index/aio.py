@@ -0,0 +1,207 @@
+import asyncio
+import concurrent.futures
+import http
+import io
+import logging
+import mimetypes
+import os
+import re
+import sys
+import typing
+import urllib.parse
+import wsgiref.headers
+
+import video_index.models as m
+import video_index.streaming as st
+
+log = logging.getLogger(__name__)
+
+stream_path = re.compile(r"/files/get/([^/]+)")
+
+
+def _status_line(version: str, status: int) -> bytes:
+    return f"{version} {status} {http.HTTPStatus(status).phrase}\r\n".encode("latin-1")
+
+
+def _head(version: str, status: int, headers: list[tuple[str, str]]) -> bytes:
+    lines = [f"{k}: {v}\r\n" for k, v in headers]
+    return _status_line(version, status) + "".join(lines).encode("latin-1") + b"\r\n"
+
+
+def _open(file_id: str) -> tuple[typing.BinaryIO, os.stat_result, str] | None:
+    f = m.get_model().files_get(file_id)
+    if f is None:
+        return None
+    mimetype = mimetypes.guess_type(f.file_path.name)[0] or "application/octet-stream"
+    file = f.file_path.open("rb")
+    return file, os.fstat(file.fileno()), mimetype
+
+
+def _call_wsgi(
+    app: typing.Callable, environ: dict
+) -> tuple[int, list[tuple[str, str]], bytes]:
+    response = []
+    # Data passed to the legacy write() callable comes before the returned iterable
+    written = []
+
+    def start_response(
+        status: str, headers: list[tuple[str, str]], exc_info: object = None
+    ) -> typing.Callable[[bytes], None]:
+        response[:] = [int(status.split(" ", 1)[0]), headers]
+        return written.append
+
+    result = app(environ, start_response)
+    try:
+        written.extend(result)
+        body = b"".join(written)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response[0], response[1], body
+
+
+class Server:
+    def __init__(
+        self, app: typing.Callable, host: str, port: int, threads: int
+    ) -> None:
+        self.app = app
+        self.host = host
+        self.port = port
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="aio"
+        )
+
+    async def _stream(
+        self,
+        writer: asyncio.StreamWriter,
+        method: str,
+        version: str,
+        headers: wsgiref.headers.Headers,
+        file_id: str,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            opened = await loop.run_in_executor(self.executor, _open, file_id)
+        except OSError:
+            log.exception(f"Could not open file {file_id}")
+            opened = None
+        if opened is None:
+            writer.write(_head(version, 404, [("Content-Length", "0")]))
+            await writer.drain()
+            return
+        file, stat, mimetype = opened
+        with file:
+            p = st.plan(method, headers, stat, mimetype)
+            writer.write(_head(version, p.status, p.headers))
+            if method == "HEAD" or not p.ranges:
+                await writer.drain()
+                return
+            if p.parts:
+                for part, (start, stop) in zip(p.parts, p.ranges, strict=True):
+                    writer.write(part)
+                    await loop.sendfile(writer.transport, file, start, stop - start)
+                writer.write(p.closing)
+                await writer.drain()
+            else:
+                start, stop = p.ranges[0]
+                await loop.sendfile(writer.transport, file, start, stop - start)
+
+    async def _wsgi(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        method: str,
+        target: str,
+        version: str,
+        headers: wsgiref.headers.Headers,
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        body = await reader.readexactly(int(headers.get("Content-Length") or 0))
+        path, _, query = target.partition("?")
+        peer = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": urllib.parse.unquote(path, encoding="latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": self.host,
+            "SERVER_PORT": str(self.port),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": peer[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace("-", "_")
+            if key not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+                key = f"HTTP_{key}"
+            environ[key] = value
+        status, response_headers, response_body = await loop.run_in_executor(
+            self.executor, _call_wsgi, self.app, environ
+        )
+        response_headers = [
+            (k, v) for k, v in response_headers if k.lower() != "content-length"
+        ]
+        response_headers.append(("Content-Length", str(len(response_body))))
+        writer.write(_head(version, status, response_headers))
+        if method != "HEAD":
+            writer.write(response_body)
+        await writer.drain()
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                method, target, version = request_line.split(" ", 2)
+                headers = wsgiref.headers.Headers(
+                    [
+                        (name.strip(), value.strip())
+                        for name, _, value in (
+                            line.partition(":") for line in header_lines if line
+                        )
+                    ]
+                )
+                connection = (headers.get("Connection") or "").lower()
+                keep_alive = version == "HTTP/1.1" and connection != "close"
+                if headers.get("Transfer-Encoding"):
+                    writer.write(_head(version, 501, [("Content-Length", "0")]))
+                    await writer.drain()
+                    return
+                match = stream_path.fullmatch(target.partition("?")[0])
+                if match and method in ("GET", "HEAD"):
+                    file_id = urllib.parse.unquote(match.group(1))
+                    await self._stream(writer, method, version, headers, file_id)
+                else:
+                    await self._wsgi(reader, writer, method, target, version, headers)
+                if not keep_alive:
+                    return
+        except (ConnectionError, ValueError) as e:
+            log.debug(f"Closing connection: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        log.info(f"Serving on http://{self.host}:{self.port} (async)")
+        async with server:
+            await server.serve_forever()
+
+
+def serve(
+    app: typing.Callable,
+    host: str = "0.0.0.0",  # noqa: S104
+    port: int = 8080,
+    threads: int = 8,
+) -> None:
+    asyncio.run(Server(app, host, port, threads).serve())
@@ -4,9 +4,14 @@ import pathlib
 import flask
 import waitress
 
+import video_index.aio as aio
+import video_index.metrics as mx
 import video_index.models as m
+import video_index.streaming as st
 import video_index.tasks as ta
 import video_index.templates as te
+import video_index.watch as wa
+import video_index.writer as w
 
 log = logging.getLogger(__name__)
 app = flask.Flask(__name__)
@@ -14,16 +19,45 @@ app = flask.Flask(__name__)
 
 @app.before_request
 def before_request() -> None:
+    mx.start_request()
     log.debug(f"{flask.request.method} {flask.request.path}")
     for k, v in flask.request.values.lists():
         log.debug(f"{k}: {v}")
 
 
+@app.after_request
+def after_request(response: flask.Response) -> flask.Response:
+    flask.g.status_code = response.status_code
+    return response
+
+
+@app.teardown_request
+def teardown_request(exc: BaseException | None) -> None:
+    # Also runs when a view raises and no response was made, which is counted as a 500
+    mx.finish_request(
+        flask.request.endpoint or "none",
+        flask.request.method,
+        flask.g.get("status_code", 500),
+    )
+
+
 @app.route("/")
 def index() -> str:
     return te.index()
 
 
+@app.route("/duplicates")
+def duplicates() -> str:
+    return te.duplicates()
+
+
+@app.route("/duplicates/groups", methods=["POST"])
+def duplicates_groups() -> str:
+    after = flask.request.values.get("after", "")
+    groups = m.get_model().files_duplicates(after)
+    return te.duplicates_list(groups)
+
+
 @app.route("/favicon.svg")
 def favicon() -> flask.Response:
     return flask.Response(te.favicon(), mimetype="image/svg+xml")
@@ -47,16 +81,27 @@ def files_editable_note(file_id: str) -> str:
 @app.route("/files/get/<file_id>")
 def files_get(file_id: str) -> flask.Response:
     f = m.get_model().files_get(file_id)
-    return flask.send_file(f.file_path)
+    if f is None:
+        flask.abort(404)
+    return st.send_file(f.file_path)
+
+
+@app.route("/files/player/<file_id>")
+def files_player(file_id: str) -> str:
+    f = m.get_model().files_get(file_id)
+    if f is None:
+        flask.abort(404)
+    return te.files_player(f)
 
 
 @app.route("/files/update-notes", methods=["POST"])
 def files_update_notes() -> str:
     file_id = flask.request.values.get("file-id")
     notes = flask.request.values.get("notes")
-    model = m.get_model()
-    model.files_update_notes(file_id, notes)
-    f = model.files_get(file_id)
+    w.submit(
+        w.INTERACTIVE, m.VideoIndexModel.files_update_notes, file_id, notes
+    ).result()
+    f = m.get_model().files_get(file_id)
     return te.files_update_notes(f)
 
 
@@ -72,19 +117,85 @@ def locations_add() -> flask.Response:
     if root_folder:
         root_path = pathlib.Path(root_folder).resolve()
         if root_path.is_dir():
-            m.get_model().locations_add(str(root_path))
+            w.submit(
+                w.INTERACTIVE, m.VideoIndexModel.locations_add, str(root_path)
+            ).result()
     return flask.redirect(flask.url_for("locations"))
 
 
+@app.route("/locations/progress")
+def locations_progress() -> flask.Response:
+    root_folder = pathlib.Path(flask.request.values.get("root-folder")).resolve()
+    progress = ta.scan_progress(root_folder)
+    # htmx stops polling on 286
+    return flask.Response(
+        te.locations_progress(root_folder, progress), 200 if progress else 286
+    )
+
+
 @app.route("/locations/scan", methods=["POST"])
 def locations_scan() -> flask.Response:
     root_folder = pathlib.Path(flask.request.values.get("root-folder")).resolve()
+    quick = "quick" in flask.request.values
     loc = m.get_model().locations_get(root_folder)
     if loc:
-        ta.scheduler.add_job(ta.scan_location, args=[loc.root_folder])
+        ta.request_scan(loc.root_folder, quick)
+    # Starts the progress pollers again, which stopped while no scan was running
+    return flask.Response("", 204, {"HX-Trigger": "scan-requested"})
+
+
+@app.route("/locations/scan/cancel", methods=["POST"])
+def locations_scan_cancel() -> flask.Response:
+    root_folder = pathlib.Path(flask.request.values.get("root-folder")).resolve()
+    ta.cancel_scan(root_folder)
+    return flask.Response("", 204)
+
+
+@app.route("/locations/schedule", methods=["POST"])
+def locations_schedule() -> flask.Response:
+    root_folder = pathlib.Path(flask.request.values.get("root-folder")).resolve()
+    # Only the intervals offered in the UI are accepted, by their option values
+    scan_intervals = {
+        "" if minutes is None else str(minutes): minutes
+        for minutes in m.Location.scan_intervals
+    }
+    value = flask.request.values.get("scan-interval")
+    if value not in scan_intervals:
+        flask.abort(400)
+    scan_interval = scan_intervals[value]
+    loc = m.get_model().locations_get(root_folder)
+    if loc:
+        w.submit(
+            w.INTERACTIVE,
+            m.VideoIndexModel.locations_schedule,
+            loc.root_folder,
+            scan_interval,
+        ).result()
+        ta.schedule_scan(loc.root_folder, scan_interval)
     return flask.Response("", 204)
 
 
+@app.route("/locations/watch", methods=["POST"])
+def locations_watch() -> flask.Response:
+    root_folder = pathlib.Path(flask.request.values.get("root-folder")).resolve()
+    watched = "watched" in flask.request.values
+    loc = m.get_model().locations_get(root_folder)
+    if loc:
+        w.submit(
+            w.INTERACTIVE, m.VideoIndexModel.locations_watch, loc.root_folder, watched
+        ).result()
+        if watched:
+            ta.scheduler.add_job(wa.watch, args=[loc.root_folder])
+        else:
+            wa.unwatch(loc.root_folder)
+    return flask.Response("", 204)
+
+
+@app.route("/metrics")
+def metrics() -> flask.Response:
+    return flask.Response(mx.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/suffixes")
 def suffixes() -> str:
     suffix_counts = m.get_model().suffixes_count()
@@ -95,11 +206,23 @@ def suffixes() -> str:
 def suffixes_enable() -> flask.Response:
     trigger_name = flask.request.headers.get("hx-trigger-name")
     suffix = pathlib.Path(trigger_name).suffix
-    m.get_model().suffixes_enable(suffix, trigger_name in flask.request.values)
+    enabled = trigger_name in flask.request.values
+    w.submit(w.INTERACTIVE, m.VideoIndexModel.suffixes_enable, suffix, enabled).result()
     return flask.Response("", 204)
 
 
-def main() -> None:
+def main(server: str = "waitress") -> None:
     m.get_model().migrate()
     ta.scheduler.start()
-    waitress.serve(app, ident=None, threads=8)
+    for scan in m.get_model().scans_resumable():
+        ta.request_scan(scan.root_folder, scan.quick, scan)
+    for loc in m.get_model().locations_list():
+        if loc.watched:
+            ta.scheduler.add_job(wa.watch, args=[loc.root_folder])
+        # Intervals stored before they were validated may be 0 or negative
+        if loc.scan_interval and loc.scan_interval > 0:
+            ta.schedule_scan(loc.root_folder, loc.scan_interval)
+    if server == "async":
+        aio.serve(app, threads=8)
+    else:
+        waitress.serve(app, ident=None, threads=8)
@@ -0,0 +1,31 @@
+import os
+import threading
+import time
+
+
+class RateLimit:
+    # Each call reserves the next slot of time its amount needs and sleeps until the
+    # slot starts, so callers across threads add up to at most rate per second
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def take(self, amount: float) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + amount / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+scan_folders = RateLimit(float(os.environ.get("SCAN_FOLDERS_PER_SECOND", "0")))
+read_bytes = RateLimit(float(os.environ.get("READ_BYTES_PER_SECOND", "0")))
+
+
+def set_read_rate(rate: float) -> None:
+    # Runs in each probe worker process, which gets its share of the budget
+    read_bytes.rate = rate
@@ -0,0 +1,62 @@
+import hashlib
+import os
+
+import video_index.budget as bu
+
+block_size = 64 * 1024
+read_size = 1024 * 1024
+
+
+def _new() -> hashlib.blake2b:
+    return hashlib.blake2b(digest_size=16)
+
+
+def partial_hash(
+    file_path: str, size: int, mtime_ns: int
+) -> tuple[str, str, str | None] | None:
+    # Hashes the first, middle and last blocks. Files that fit in those blocks are
+    # read whole, so their content hash comes for free. Returns None when the file
+    # changed since it was scanned, so a stale hash is never stored.
+    try:
+        with open(file_path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                return None
+            h = _new()
+            h.update(size.to_bytes(8, "big"))
+            if size <= 3 * block_size:
+                bu.read_bytes.take(size)
+                data = f.read()
+                h.update(data)
+                content = _new()
+                content.update(data)
+                return file_path, h.hexdigest(), content.hexdigest()
+            bu.read_bytes.take(3 * block_size)
+            # pread raises or returns short reads for a file truncated since the fstat,
+            # where reading a mapping past the new end would kill the process
+            for start in (0, (size - block_size) // 2, size - block_size):
+                data = os.pread(f.fileno(), block_size, start)
+                if len(data) < block_size:
+                    return None
+                h.update(data)
+            return file_path, h.hexdigest(), None
+    except OSError:
+        return None
+
+
+def content_hash(file_path: str, size: int, mtime_ns: int) -> tuple[str, str] | None:
+    try:
+        with open(file_path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                return None
+            h = _new()
+            while True:
+                bu.read_bytes.take(read_size)
+                data = f.read(read_size)
+                if not data:
+                    break
+                h.update(data)
+            return file_path, h.hexdigest()
+    except OSError:
+        return None
@@ -0,0 +1,153 @@
+import bisect
+import logging
+import math
+import os
+import textwrap
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Statements that take longer than this many seconds are logged with their parameters
+slow_query_seconds = float(os.environ.get("SLOW_QUERY_SECONDS", "0.1"))
+
+latency_buckets = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+row_buckets = (0, 1, 10, 100, 1000, 10000, 100000)
+
+_histograms: list["Histogram"] = []
+# Time spent in queries by the request the current thread is serving
+_local = threading.local()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.buckets = (*buckets, math.inf)
+        self._lock = threading.Lock()
+        # Label values mapped to per-bucket counts and the sum of observed values
+        self._series: dict[tuple[tuple[str, str], ...], list] = {}
+        _histograms.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._series.items()
+            ]
+        for key, counts, total in sorted(series):
+            labels = "".join(f'{k}="{_escape(v)}",' for k, v in key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            labels = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+query_seconds = Histogram(
+    "video_index_query_seconds",
+    "Time spent running SQL statements, by model method",
+    latency_buckets,
+)
+query_rows = Histogram(
+    "video_index_query_rows",
+    "Rows returned, changed or written by SQL statements, by model method",
+    row_buckets,
+)
+request_seconds = Histogram(
+    "video_index_request_seconds",
+    "Time spent handling requests, by endpoint",
+    latency_buckets,
+)
+request_query_seconds = Histogram(
+    "video_index_request_query_seconds",
+    "Time spent running SQL statements while handling requests, by endpoint",
+    latency_buckets,
+)
+write_wait_seconds = Histogram(
+    "video_index_write_wait_seconds",
+    "Time writes wait in the queue for the writer thread",
+    latency_buckets,
+)
+write_seconds = Histogram(
+    "video_index_write_seconds",
+    "Time spent running writes on the writer thread",
+    latency_buckets,
+)
+
+
+def record_query(
+    method: str,
+    op: str,
+    sql: str,
+    params: dict | list[dict] | None,
+    seconds: float,
+    rows: int,
+) -> None:
+    query_seconds.observe(seconds, method=method, op=op)
+    query_rows.observe(rows, method=method, op=op)
+    if hasattr(_local, "query_seconds"):
+        _local.query_seconds += seconds
+    if seconds >= slow_query_seconds:
+        if isinstance(params, list):
+            params = f"{len(params)} parameter sets"
+        log.warning(
+            f"Slow query in {method} took {seconds:.3f} s, {rows} rows\n"
+            f"{textwrap.dedent(sql).strip()}\n{params}"
+        )
+
+
+def start_request() -> None:
+    _local.started = time.perf_counter()
+    _local.query_seconds = 0.0
+
+
+def finish_request(endpoint: str, method: str, status: int) -> None:
+    started = getattr(_local, "started", None)
+    if started is None:
+        return
+    labels = {"endpoint": endpoint, "method": method, "status": str(status)}
+    request_seconds.observe(time.perf_counter() - started, **labels)
+    request_query_seconds.observe(_local.query_seconds, **labels)
+    del _local.started, _local.query_seconds
+
+
+def render() -> str:
+    return "\n".join(line for h in _histograms for line in h.render()) + "\n"
@@ -1,43 +1,163 @@
+import contextlib
 import datetime
+import json
 import logging
+import os
 import pathlib
+import re
 import secrets
+import sys
+import threading
+import time
+import typing
 import zoneinfo
 
 import flask
 import fort
 import htpy
 
+import video_index.metrics as mx
+
 log = logging.getLogger(__name__)
 tz = zoneinfo.ZoneInfo("America/Chicago")
+# Searches with fewer matches than this sort them, others walk files in path order
+search_sort_limit = 1000
+_local = threading.local()
+_query_helpers = {"_q_gen", "_transaction", "b", "u"}
+
+
+def _path_range(root_folder: pathlib.Path | str) -> dict[str, str]:
+    # Every path below root_folder sorts between "root_folder/" and "root_folder0",
+    # because "0" is the character after the path separator
+    path_lo = os.path.join(root_folder, "")
+    path_hi = path_lo[:-1] + chr(ord(os.sep) + 1)
+    return {
+        "path_lo": path_lo,
+        "path_hi": path_hi,
+    }
+
+
+def _caller() -> str:
+    # The model method a statement runs for, found by skipping the query helpers and
+    # frames outside this module such as fort and contextlib
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals is globals() and frame.f_code.co_name not in _query_helpers:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "unknown"
+
+
+def _file_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TiB"
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def _search_query(q: str) -> str:
+    # Each word becomes a quoted FTS5 prefix phrase, so punctuation in the search box
+    # is tokenized like the indexed paths instead of being parsed as query syntax
+    terms = [t.replace('"', '""') for t in q.split() if re.search(r"\w", t)]
+    return " ".join(f'"{t}"*' for t in terms)
 
 
 class File:
-    def __init__(self, file_path: pathlib.Path, file_id: str, notes: str) -> None:
+    __slots__ = (
+        "bitrate",
+        "duration",
+        "file_path",
+        "height",
+        "id",
+        "notes",
+        "video_codec",
+        "width",
+    )
+
+    def __init__(
+        self,
+        file_path: pathlib.Path,
+        file_id: str,
+        notes: str,
+        duration: float | None = None,
+        width: int | None = None,
+        height: int | None = None,
+        video_codec: str | None = None,
+        bitrate: int | None = None,
+    ) -> None:
         self.file_path = file_path
         self.id = file_id
         self.notes = notes
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.video_codec = video_codec
+        self.bitrate = bitrate
+
+    @classmethod
+    def from_row(cls, row: dict) -> "File":
+        return cls(
+            pathlib.Path(row["file_path"]),
+            row["id"],
+            row["notes"],
+            row["duration"],
+            row["width"],
+            row["height"],
+            row["video_codec"],
+            row["bitrate"],
+        )
 
     @property
     def card(self) -> htpy.Element:
         return htpy.div(".col.pb-3")[
             htpy.div(".card.h-100")[
-                htpy.video(
-                    ".card-img-top",
-                    controls=True,
-                    preload="metadata",
-                    src=flask.url_for("files_get", file_id=self.id),
-                ),
+                htpy.div(
+                    ".card-img-top.bg-dark.ratio.ratio-16x9",
+                    hx_get=flask.url_for("files_player", file_id=self.id),
+                    hx_swap="outerHTML",
+                    role="button",
+                    title="Play",
+                )[
+                    htpy.div(".d-flex.align-items-center.justify-content-center")[
+                        htpy.i(".bi-play-circle.fs-1.text-light")
+                    ]
+                ],
                 htpy.div(".card-body")[
                     htpy.h5(".card-title")[self.file_path.name],
                     htpy.h6(".card-subtitle.mb-2.text-body-secondary")[
                         htpy.small[str(self.file_path.parent)]
                     ],
+                    self.details,
                     self.notes_control,
                 ],
             ]
         ]
 
+    @property
+    def details(self) -> htpy.Element | None:
+        details_text = self.details_text
+        if details_text:
+            return htpy.p(".card-text.small.text-body-secondary")[details_text]
+        return None
+
+    @property
+    def details_text(self) -> str:
+        details = []
+        if self.duration is not None:
+            minutes, seconds = divmod(round(self.duration), 60)
+            hours, minutes = divmod(minutes, 60)
+            details.append(f"{hours}:{minutes:02}:{seconds:02}")
+        if self.width and self.height:
+            details.append(f"{self.width}\u00d7{self.height}")
+        if self.video_codec:
+            details.append(self.video_codec)
+        if self.bitrate:
+            details.append(f"{self.bitrate / 1000000:.1f} Mb/s")
+        return " \u00b7 ".join(details)
+
     @property
     def editable_note(self) -> htpy.Element:
         return htpy.form(
@@ -49,6 +169,16 @@ class File:
             htpy.button(".btn.btn-outline-primary", type="submit")["Save"],
         ]
 
+    @property
+    def player(self) -> htpy.Element:
+        return htpy.video(
+            ".card-img-top",
+            autoplay=True,
+            controls=True,
+            preload="metadata",
+            src=flask.url_for("files_get", file_id=self.id),
+        )
+
     @property
     def notes_control(self) -> htpy.Element:
         return htpy.p(
@@ -59,13 +189,72 @@ class File:
         )[self.notes or "(No notes)"]
 
 
+class DuplicateGroup:
+    __slots__ = ("content_hash", "files", "size")
+
+    def __init__(self, content_hash: str, size: int, files: list[File]) -> None:
+        self.content_hash = content_hash
+        self.size = size
+        self.files = files
+
+    @property
+    def card(self) -> htpy.Element:
+        return htpy.div(".col-12.pb-3")[
+            htpy.div(".card")[
+                htpy.div(".card-header")[
+                    f"{len(self.files)} copies \u00b7 {_file_size(self.size)} each ",
+                    htpy.small(".text-body-secondary")[htpy.code[self.content_hash]],
+                ],
+                htpy.ul(".list-group.list-group-flush")[
+                    [
+                        htpy.li(".list-group-item")[
+                            htpy.a(href=flask.url_for("files_get", file_id=f.id))[
+                                htpy.code[str(f.file_path)]
+                            ],
+                            f.details,
+                        ]
+                        for f in self.files
+                    ]
+                ],
+            ]
+        ]
+
+
+class Folder:
+    __slots__ = ("entry_count", "folder_path", "mtime_ns")
+
+    def __init__(self, folder_path: str, mtime_ns: int, entry_count: int) -> None:
+        self.folder_path = folder_path
+        self.mtime_ns = mtime_ns
+        self.entry_count = entry_count
+
+
 class Location:
-    col_count: int = 4
+    __slots__ = (
+        "file_count",
+        "last_scan_completed_at",
+        "last_scan_started_at",
+        "root_folder",
+        "scan_interval",
+        "watched",
+    )
+    col_count: int = 7
+    # Rescan intervals offered in the UI, in minutes
+    scan_intervals: typing.ClassVar[dict[int | None, str]] = {
+        None: "Never",
+        60: "Hourly",
+        360: "Every 6 hours",
+        1440: "Daily",
+        10080: "Weekly",
+    }
     thead: htpy.Element = htpy.thead[
         htpy.tr[
             htpy.th["Root folder"],
+            htpy.th["Files"],
             htpy.th["Last scan started"],
             htpy.th["Last scan completed"],
+            htpy.th(".text-center")["Watch"],
+            htpy.th["Rescan"],
             htpy.th,
         ]
     ]
@@ -75,15 +264,40 @@ class Location:
         root_folder: pathlib.Path,
         last_scan_started_at: datetime.datetime,
         last_scan_completed_at: datetime.datetime,
+        file_count: int,
+        watched: bool = False,
+        scan_interval: int | None = None,
     ) -> None:
         self.root_folder = root_folder
         self.last_scan_started_at = last_scan_started_at
         self.last_scan_completed_at = last_scan_completed_at
+        self.file_count = file_count
+        self.watched = watched
+        self.scan_interval = scan_interval
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Location":
+        return cls(
+            pathlib.Path(row["root_folder"]),
+            datetime.datetime.fromisoformat(row["last_scan_started_at"])
+            if row["last_scan_started_at"]
+            else None,
+            datetime.datetime.fromisoformat(row["last_scan_completed_at"])
+            if row["last_scan_completed_at"]
+            else None,
+            row["file_count"],
+            bool(row["watched"]),
+            row["scan_interval"],
+        )
 
     @property
     def tr(self) -> htpy.Element:
         return htpy.tr[
-            htpy.td[htpy.code[str(self.root_folder)]],
+            htpy.td[
+                htpy.code[str(self.root_folder)],
+                ScanProgress.poller(self.root_folder, "load"),
+            ],
+            htpy.td(".text-end")[self.file_count],
             htpy.td[
                 self.last_scan_started_at
                 and self.last_scan_started_at.astimezone(tz).isoformat()
@@ -92,18 +306,170 @@ class Location:
                 self.last_scan_completed_at
                 and self.last_scan_completed_at.astimezone(tz).isoformat()
             ],
+            htpy.td(".ps-4.text-center")[
+                htpy.div(".form-check.form-switch")[
+                    htpy.input(
+                        ".form-check-input",
+                        checked=self.watched,
+                        hx_post=flask.url_for("locations_watch"),
+                        hx_vals=json.dumps({"root-folder": str(self.root_folder)}),
+                        name="watched",
+                        title="Keep this location current as files change",
+                        type="checkbox",
+                    ),
+                ]
+            ],
+            htpy.td[
+                htpy.select(
+                    ".form-select.form-select-sm",
+                    hx_post=flask.url_for("locations_schedule"),
+                    hx_vals=json.dumps({"root-folder": str(self.root_folder)}),
+                    name="scan-interval",
+                    title="Quick scan this location on a schedule",
+                )[
+                    [
+                        htpy.option(
+                            selected=minutes == self.scan_interval,
+                            value="" if minutes is None else str(minutes),
+                        )[label]
+                        for minutes, label in self.scan_intervals.items()
+                    ]
+                ]
+            ],
             htpy.td[
                 htpy.button(
-                    ".btn.btn-outline-primary.btn-sm",
+                    ".btn.btn-outline-primary.btn-sm.me-1",
                     hx_post=flask.url_for("locations_scan"),
                     name="root-folder",
                     title="Scan now",
                     value=str(self.root_folder),
                     type="button",
-                )[htpy.i(".bi-search")]
+                )[htpy.i(".bi-search")],
+                htpy.button(
+                    ".btn.btn-outline-primary.btn-sm",
+                    hx_post=flask.url_for("locations_scan"),
+                    hx_vals='{"quick": "true"}',
+                    name="root-folder",
+                    title="Quick scan (only changed folders)",
+                    value=str(self.root_folder),
+                    type="button",
+                )[htpy.i(".bi-lightning")],
+            ],
+        ]
+
+
+class Scan:
+    __slots__ = ("checkpoint", "id", "quick", "root_folder")
+
+    def __init__(
+        self,
+        scan_id: int,
+        root_folder: pathlib.Path,
+        quick: bool,
+        checkpoint: list[str],
+    ) -> None:
+        self.id = scan_id
+        self.root_folder = root_folder
+        self.quick = quick
+        self.checkpoint = checkpoint
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Scan":
+        return cls(
+            row["id"],
+            pathlib.Path(row["root_folder"]),
+            bool(row["quick"]),
+            json.loads(row["checkpoint"]),
+        )
+
+
+class ScanProgress:
+    # Counters for a running scan. They are only kept in memory and updated by the
+    # thread running the scan, so publishing them costs no database writes.
+    __slots__ = (
+        "current_folder",
+        "files_listed",
+        "files_written",
+        "folders_listed",
+        "phase",
+        "queued",
+        "quick",
+        "root_folder",
+        "started",
+        "updated",
+    )
+    # Seconds without a listing before the scan is shown as stalled
+    stall_after: float = 30.0
+
+    def __init__(self, root_folder: pathlib.Path, quick: bool) -> None:
+        self.root_folder = root_folder
+        self.quick = quick
+        self.phase = "Listing folders"
+        self.current_folder = None
+        self.folders_listed = 0
+        self.files_listed = 0
+        self.files_written = 0
+        self.queued = 0
+        self.started = time.monotonic()
+        self.updated = self.started
+
+    @property
+    def div(self) -> htpy.Element:
+        now = time.monotonic()
+        rate = self.files_listed / max(now - self.started, 1)
+        stalled = now - self.updated
+        return self.poller(self.root_folder, "every 2s")[
+            htpy.div(".small.text-body-secondary")[
+                htpy.button(
+                    ".btn.btn-outline-danger.btn-sm.me-1",
+                    hx_post=flask.url_for("locations_scan_cancel"),
+                    name="root-folder",
+                    title="Cancel scan",
+                    value=str(self.root_folder),
+                    type="button",
+                )[htpy.i(".bi-x-circle")],
+                htpy.span(".spinner-border.spinner-border-sm.me-1"),
+                f"{self.phase}{' (quick)' if self.quick else ''}: ",
+                f"{self.folders_listed:,} folders, ",
+                f"{self.files_listed:,} files listed, ",
+                f"{self.files_written:,} written, ",
+                f"{rate:,.0f} files/s, ",
+                f"about {self.queued:,} folders queued",
+                stalled >= self.stall_after
+                and htpy.span(".text-danger")[f", no progress for {stalled:.0f} s"],
+            ],
+            self.current_folder
+            and htpy.div(".small.text-body-secondary.text-truncate")[
+                htpy.code[self.current_folder]
             ],
         ]
 
+    @staticmethod
+    def poller(root_folder: pathlib.Path, trigger: str) -> htpy.Element:
+        # Each response replaces the poller, so the trigger of the response decides
+        # whether and how polling goes on
+        return htpy.div(
+            hx_get=flask.url_for("locations_progress"),
+            hx_swap="outerHTML",
+            hx_trigger=trigger,
+            hx_vals=json.dumps({"root-folder": str(root_folder)}),
+        )
+
+    def listed(self, folder_path: str, file_count: int, folder_count: int) -> None:
+        self.current_folder = folder_path
+        self.folders_listed += 1
+        self.files_listed += file_count
+        self.queued += folder_count - 1
+        self.updated = time.monotonic()
+
+
+class ScannedFile(typing.NamedTuple):
+    file_path: str
+    device: int | None = None
+    inode: int | None = None
+    size: int | None = None
+    mtime_ns: int | None = None
+
 
 class SuffixCount:
     thead: htpy.Element = htpy.thead[
@@ -140,6 +506,45 @@ class SuffixCount:
 
 class VideoIndexModel(fort.SQLiteDatabase):
     _version: int = None
+    pragmas: typing.ClassVar[dict[str, str | int]] = {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 5000,
+        "cache_size": -32768,
+        "mmap_size": 268435456,
+        "temp_store": "memory",
+    }
+
+    def __init__(self, dsn: str | pathlib.Path) -> None:
+        super().__init__(dsn)
+        for name, value in self.pragmas.items():
+            self.u(f"pragma {name} = {value}")
+
+    def _q_gen(self, sql: str, params: dict | None = None) -> typing.Iterator[dict]:
+        method = _caller()
+        start = time.perf_counter()
+        rows = 0
+        try:
+            for row in super()._q_gen(sql, params):
+                rows += 1
+                yield row
+        finally:
+            mx.record_query(method, "q", sql, params, time.perf_counter() - start, rows)
+
+    def b(self, sql: str, params: list[dict]) -> None:
+        method = _caller()
+        start = time.perf_counter()
+        super().b(sql, params)
+        mx.record_query(
+            method, "b", sql, params, time.perf_counter() - start, len(params)
+        )
+
+    def u(self, sql: str, params: dict | None = None) -> int:
+        method = _caller()
+        start = time.perf_counter()
+        rows = super().u(sql, params)
+        mx.record_query(method, "u", sql, params, time.perf_counter() - start, rows)
+        return rows
 
     def _table_exists(self, table_name: str) -> bool:
         log.debug(f"Searching database for table {table_name!r}")
@@ -159,26 +564,224 @@ class VideoIndexModel(fort.SQLiteDatabase):
         log.debug(f"Table {table_name!r} not found")
         return False
 
-    def files_add(self, file_path: pathlib.Path) -> None:
+    @contextlib.contextmanager
+    def _transaction(self) -> typing.Iterator[None]:
+        self.u("begin")
+        try:
+            yield
+        except BaseException:
+            self.u("rollback")
+            raise
+        self.u("commit")
+
+    def _files_add_many(self, files: list[ScannedFile], scan_id: int) -> None:
+        # Every set expression sees the old row, so the hashes are cleared when the
+        # size or mtime recorded by this scan differs from the one they were read at
         sql = """
             insert into files (
-                file_path, id, suffix, last_scanned_at
+                file_path, id, suffix, folder_path, scan_id, first_scan_id,
+                last_scanned_at, device, inode, size, mtime_ns
             ) values (
-                :file_path, :id, :suffix, :last_scanned_at
+                :file_path, :id, :suffix, :folder_path, :scan_id, :scan_id,
+                :last_scanned_at, :device, :inode, :size, :mtime_ns
             ) on conflict (file_path) do update set
-                scanned = 1, last_scanned_at = excluded.last_scanned_at
+                scan_id = excluded.scan_id,
+                last_scanned_at = excluded.last_scanned_at,
+                device = excluded.device,
+                inode = excluded.inode,
+                size = excluded.size,
+                mtime_ns = excluded.mtime_ns,
+                partial_hash = iif(
+                    size is excluded.size and mtime_ns is excluded.mtime_ns,
+                    partial_hash,
+                    null
+                ),
+                content_hash = iif(
+                    size is excluded.size and mtime_ns is excluded.mtime_ns,
+                    content_hash,
+                    null
+                )
+        """
+        last_scanned_at = datetime.datetime.now(datetime.UTC).isoformat()
+        params = []
+        for f in files:
+            # Paths are normalized once here so reads never have to touch the
+            # filesystem. This is lexical only: files below a symlinked folder keep
+            # the link's path and stay inside their location.
+            file_path = pathlib.Path(os.path.normpath(f.file_path))
+            params.append(
+                {
+                    "file_path": str(file_path),
+                    "id": secrets.token_urlsafe(8),
+                    "suffix": file_path.suffix,
+                    "folder_path": str(file_path.parent),
+                    "scan_id": scan_id,
+                    "last_scanned_at": last_scanned_at,
+                    "device": f.device,
+                    "inode": f.inode,
+                    "size": f.size,
+                    "mtime_ns": f.mtime_ns,
+                }
+            )
+        self.b(sql, params)
+
+    def _files_reconcile_moves(self, root_folder: pathlib.Path, scan_id: int) -> int:
+        # A file that first appeared in this scan and has the device, inode and size
+        # of a file that was not seen in this scan was moved or renamed. The old row
+        # takes the new path so its id, notes, metadata and hashes are kept.
+        sql = """
+            select
+                n.file_key as new_key, o.file_key as old_key, n.file_path,
+                n.suffix, n.folder_path, n.last_scanned_at
+            from files n
+            join files o on o.device = n.device and o.inode = n.inode
+            where n.first_scan_id = :scan_id
+            and n.file_path >= :path_lo and n.file_path < :path_hi
+            and o.size = n.size
+            and o.scan_id < :scan_id
+            and o.file_path >= :path_lo and o.file_path < :path_hi
+        """
+        params = {
+            "scan_id": scan_id,
+            **_path_range(root_folder),
+        }
+        moves = []
+        matched = set()
+        for row in self.q(sql, params):
+            if row["new_key"] in matched or row["old_key"] in matched:
+                continue
+            matched.update((row["new_key"], row["old_key"]))
+            moves.append({**row, "scan_id": scan_id})
+        self._files_apply_moves(moves)
+        return len(moves)
+
+    def _files_apply_moves(self, moves: list[dict]) -> None:
+        sql = """
+            delete from files
+            where file_key = :new_key
+        """
+        self.b(sql, moves)
+        sql = """
+            update files set
+                file_path = :file_path,
+                suffix = :suffix,
+                folder_path = :folder_path,
+                scan_id = :scan_id,
+                last_scanned_at = :last_scanned_at
+            where file_key = :old_key
+        """
+        self.b(sql, moves)
+
+    def _folders_add_many(self, folders: list[Folder], scan_id: int) -> None:
+        sql = """
+            insert into folders (
+                folder_path, mtime_ns, entry_count, scan_id
+            ) values (
+                :folder_path, :mtime_ns, :entry_count, :scan_id
+            ) on conflict (folder_path) do update set
+                mtime_ns = excluded.mtime_ns,
+                entry_count = excluded.entry_count,
+                scan_id = excluded.scan_id
+        """
+        params = [
+            {
+                "folder_path": f.folder_path,
+                "mtime_ns": f.mtime_ns,
+                "entry_count": f.entry_count,
+                "scan_id": scan_id,
+            }
+            for f in folders
+        ]
+        self.b(sql, params)
+
+    def _locations_count_files(self, root_folder: str) -> None:
+        sql = """
+            update locations
+            set file_count = (
+                select count(*)
+                from files
+                where file_path >= :path_lo and file_path < :path_hi
+            )
+            where root_folder = :root_folder
         """
         params = {
-            "file_path": str(file_path),
-            "id": secrets.token_urlsafe(8),
-            "suffix": file_path.suffix,
-            "last_scanned_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            "root_folder": root_folder,
+            **_path_range(root_folder),
         }
         self.u(sql, params)
 
+    def files_content_hash_candidates(
+        self, root_folder: pathlib.Path
+    ) -> list[tuple[str, int, int]]:
+        # Files anywhere whose size and partial hash collide with a file in this
+        # location, so copies in other locations are hashed too. Only enabled
+        # suffixes count, so identical sidecar files are never read.
+        sql = """
+            select distinct d.file_path, d.size, d.mtime_ns
+            from files f
+            join suffixes s on s.suffix = f.suffix
+            join files d on d.size = f.size and d.partial_hash = f.partial_hash
+            join suffixes ds on ds.suffix = d.suffix
+            where f.file_path >= :path_lo and f.file_path < :path_hi
+            and s.enabled = 1
+            and ds.enabled = 1
+            and d.content_hash is null
+            and exists (
+                select 1
+                from files o
+                join suffixes os on os.suffix = o.suffix
+                where o.size = f.size and o.partial_hash = f.partial_hash
+                and o.file_key != f.file_key
+                and os.enabled = 1
+            )
+        """
+        params = _path_range(root_folder)
+        return [
+            (row["file_path"], row["size"], row["mtime_ns"])
+            for row in self.q(sql, params)
+        ]
+
+    def files_duplicates(self, after: str = "") -> list[DuplicateGroup]:
+        # Files with disabled suffixes are hidden everywhere, including here
+        sql = """
+            select f.content_hash
+            from files f
+            join suffixes s on s.suffix = f.suffix
+            where f.content_hash > :after
+            and s.enabled = 1
+            group by f.content_hash
+            having count(*) > 1
+            order by f.content_hash limit 21
+        """
+        params = {
+            "after": after,
+        }
+        content_hashes = [row["content_hash"] for row in self.q(sql, params)]
+        sql = """
+            select
+                f.file_path, f.id, f.notes, f.duration, f.width, f.height,
+                f.video_codec, f.bitrate, f.size, f.content_hash
+            from files f
+            join suffixes s on s.suffix = f.suffix
+            where f.content_hash in (select value from json_each(:content_hashes))
+            and s.enabled = 1
+            order by f.content_hash, f.file_path
+        """
+        params = {
+            "content_hashes": json.dumps(content_hashes),
+        }
+        groups = {}
+        for row in self.q(sql, params):
+            content_hash = row["content_hash"]
+            if content_hash not in groups:
+                groups[content_hash] = DuplicateGroup(content_hash, row["size"], [])
+            groups[content_hash].files.append(File.from_row(row))
+        return list(groups.values())
+
     def files_get(self, file_id: str) -> File | None:
         sql = """
-            select file_path, id, notes
+            select
+                file_path, id, notes, duration, width, height, video_codec, bitrate
             from files
             where id = :id
         """
@@ -187,35 +790,131 @@ class VideoIndexModel(fort.SQLiteDatabase):
         }
         f = self.q_one(sql, params)
         if f:
-            return File(pathlib.Path(f["file_path"]).resolve(), f["id"], f["notes"])
+            return File.from_row(f)
 
     def files_list(
         self, after: str = "", missing_notes_only: bool = False, q: str | None = None
     ) -> list[File]:
-        where_clause = "f.scanned = 1 and s.enabled = 1 and f.file_path > :after"
+        where_clause = "s.enabled = 1 and f.file_path > :after"
         if missing_notes_only:
-            where_clause = f"{where_clause} and length(f.notes) = 0"
-        if q:
-            where_clause = f"""
-                {where_clause} and
-                instr(lower(f.file_path || ' ' || f.notes), lower(:q)) > 0
-            """
+            where_clause = f"{where_clause} and f.notes = ''"
+        params = {
+            "after": after,
+            "limit": search_sort_limit,
+            "search_query": _search_query(q or ""),
+        }
+        if params["search_query"]:
+            # Up to search_sort_limit matches are read from the index and sorted here.
+            # More than that are common enough that walking files in path order fills
+            # the page sooner than sorting every match would.
+            sql = f"""
+                select
+                    f.file_path, f.id, f.notes, f.duration, f.width, f.height,
+                    f.video_codec, f.bitrate
+                from files_fts
+                join files f on f.file_key = files_fts.rowid
+                join suffixes s on s.suffix = f.suffix
+                where {where_clause} and files_fts match :search_query
+                limit :limit
+            """  # noqa: S608
+            rows = self.q(sql, params)
+            if len(rows) < search_sort_limit:
+                rows = sorted(rows, key=lambda row: row["file_path"])
+                return [File.from_row(row) for row in rows[:6]]
+            matches = "select rowid from files_fts where files_fts match :search_query"
+            where_clause = f"{where_clause} and +f.file_key in ({matches})"
         sql = f"""
-            select f.file_path, f.id, f.last_scanned_at, f.notes
+            select
+                f.file_path, f.id, f.notes, f.duration, f.width, f.height,
+                f.video_codec, f.bitrate
             from files f
             join suffixes s on s.suffix = f.suffix
             where {where_clause}
             order by f.file_path limit 6
         """  # noqa: S608
+        return [File.from_row(row) for row in self.q(sql, params)]
+
+    def files_partial_hash_candidates(
+        self, root_folder: pathlib.Path
+    ) -> list[tuple[str, int, int]]:
+        # Files anywhere whose size collides with a file in this location, among
+        # files with enabled suffixes
+        sql = """
+            select distinct d.file_path, d.size, d.mtime_ns
+            from files f
+            join suffixes s on s.suffix = f.suffix
+            join files d on d.size = f.size
+            join suffixes ds on ds.suffix = d.suffix
+            where f.file_path >= :path_lo and f.file_path < :path_hi
+            and s.enabled = 1
+            and ds.enabled = 1
+            and f.size > 0
+            and d.partial_hash is null
+            and exists (
+                select 1
+                from files o
+                join suffixes os on os.suffix = o.suffix
+                where o.size = f.size and o.file_key != f.file_key
+                and os.enabled = 1
+            )
+        """
+        params = _path_range(root_folder)
+        return [
+            (row["file_path"], row["size"], row["mtime_ns"])
+            for row in self.q(sql, params)
+        ]
+
+    def files_probe_candidates(
+        self, root_folder: pathlib.Path, suffixes: set[str], after: str, limit: int
+    ) -> list[tuple[str, int, int]]:
+        # Files the scan found new or changed, going by the size and mtime it recorded
+        sql = """
+            select file_path, size, mtime_ns
+            from files
+            where file_path >= :path_lo and file_path < :path_hi
+            and file_path > :after
+            and suffix in (select value from json_each(:suffixes))
+            and size is not null
+            and (probe_size is not size or probe_mtime_ns is not mtime_ns)
+            order by file_path
+            limit :limit
+        """
         params = {
             "after": after,
-            "q": q,
+            "limit": limit,
+            "suffixes": json.dumps(sorted(suffixes)),
+            **_path_range(root_folder),
         }
         return [
-            File(pathlib.Path(row["file_path"]).resolve(), row["id"], row["notes"])
+            (row["file_path"], row["size"], row["mtime_ns"])
             for row in self.q(sql, params)
         ]
 
+    def files_update_hashes(self, hashes: list[dict]) -> None:
+        sql = """
+            update files set
+                partial_hash = coalesce(:partial_hash, partial_hash),
+                content_hash = coalesce(:content_hash, content_hash)
+            where file_path = :file_path
+        """
+        with self._transaction():
+            self.b(sql, hashes)
+
+    def files_update_metadata(self, metadata: list[dict]) -> None:
+        sql = """
+            update files set
+                duration = :duration,
+                width = :width,
+                height = :height,
+                video_codec = :video_codec,
+                bitrate = :bitrate,
+                probe_size = :probe_size,
+                probe_mtime_ns = :probe_mtime_ns
+            where file_path = :file_path
+        """
+        with self._transaction():
+            self.b(sql, metadata)
+
     def files_update_notes(self, file_id: str, notes: str) -> None:
         sql = """
             update files
@@ -228,19 +927,43 @@ class VideoIndexModel(fort.SQLiteDatabase):
         }
         self.u(sql, params)
 
+    def folders_list(self, root_folder: pathlib.Path) -> dict[str, Folder]:
+        sql = """
+            select folder_path, mtime_ns, entry_count
+            from folders
+            where folder_path = :root_folder
+            or (folder_path >= :path_lo and folder_path < :path_hi)
+        """
+        params = {
+            "root_folder": str(root_folder),
+            **_path_range(root_folder),
+        }
+        return {
+            row["folder_path"]: Folder(
+                row["folder_path"], row["mtime_ns"], row["entry_count"]
+            )
+            for row in self.q(sql, params)
+        }
+
     def locations_add(self, root_folder: str) -> None:
         sql = """
             insert into locations (root_folder) values (:root_folder)
             on conflict (root_folder) do nothing
         """
         params = {
-            "root_folder": root_folder,
+            "root_folder": str(pathlib.Path(root_folder).resolve()),
         }
-        self.u(sql, params)
+        with self._transaction():
+            # The count triggers only follow inserts and deletes, so a location over
+            # files that are already indexed starts from their count
+            if self.u(sql, params):
+                self._locations_count_files(params["root_folder"])
 
     def locations_get(self, root_folder: pathlib.Path) -> Location | None:
         sql = """
-            select root_folder, last_scan_started_at, last_scan_completed_at
+            select
+                root_folder, last_scan_started_at, last_scan_completed_at, file_count,
+                watched, scan_interval
             from locations
             where root_folder = :root_folder
         """
@@ -249,71 +972,303 @@ class VideoIndexModel(fort.SQLiteDatabase):
         }
         row = self.q_one(sql, params)
         if row:
-            return Location(
-                pathlib.Path(row["root_folder"]).resolve(),
-                datetime.datetime.fromisoformat(row["last_scan_started_at"])
-                if row["last_scan_started_at"]
-                else None,
-                datetime.datetime.fromisoformat(row["last_scan_completed_at"])
-                if row["last_scan_completed_at"]
-                else None,
-            )
+            return Location.from_row(row)
 
     def locations_list(self) -> list[Location]:
         sql = """
-            select root_folder, last_scan_started_at, last_scan_completed_at
+            select
+                root_folder, last_scan_started_at, last_scan_completed_at, file_count,
+                watched, scan_interval
             from locations
             order by root_folder
         """
-        return [
-            Location(
-                pathlib.Path(row["root_folder"]).resolve(),
-                datetime.datetime.fromisoformat(row["last_scan_started_at"])
-                if row["last_scan_started_at"]
-                else None,
-                datetime.datetime.fromisoformat(row["last_scan_completed_at"])
-                if row["last_scan_completed_at"]
-                else None,
-            )
-            for row in self.q(sql)
-        ]
+        return [Location.from_row(row) for row in self.q(sql)]
+
+    def locations_scan_cancel(self, root_folder: pathlib.Path, scan_id: int) -> None:
+        params = {
+            "root_folder": str(root_folder),
+            "cancelled_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            "scan_id": scan_id,
+            **_path_range(root_folder),
+        }
+        with self._transaction():
+            # Folders written by a scan that never completes have their new mtime but
+            # still hold the files that were deleted from them, so the next scan lists
+            # them again
+            sql = """
+                update folders
+                set mtime_ns = -1
+                where (
+                    folder_path = :root_folder
+                    or (folder_path >= :path_lo and folder_path < :path_hi)
+                )
+                and scan_id = :scan_id
+            """
+            self.u(sql, params)
+            sql = """
+                update scans set
+                    cancelled_at = :cancelled_at,
+                    checkpoint = null
+                where id = :scan_id
+            """
+            self.u(sql, params)
+
+    def locations_scan_complete(self, root_folder: pathlib.Path, scan_id: int) -> None:
+        now = datetime.datetime.now(datetime.UTC).isoformat()
+        params = {
+            "root_folder": str(root_folder),
+            "last_scan_completed_at": now,
+            "scan_id": scan_id,
+            **_path_range(root_folder),
+        }
+        with self._transaction():
+            sql = """
+                update locations
+                set last_scan_completed_at = :last_scan_completed_at
+                where root_folder = :root_folder
+            """
+            self.u(sql, params)
+            sql = """
+                update scans set
+                    completed_at = :last_scan_completed_at,
+                    checkpoint = null
+                where id = :scan_id
+            """
+            self.u(sql, params)
+            moved = self._files_reconcile_moves(root_folder, scan_id)
+            if moved:
+                log.info(f"Moved {moved} files in {root_folder}")
+            sql = """
+                delete from files
+                where file_path >= :path_lo and file_path < :path_hi
+                and scan_id < :scan_id
+            """
+            self.u(sql, params)
+            sql = """
+                delete from folders
+                where (
+                    folder_path = :root_folder
+                    or (folder_path >= :path_lo and folder_path < :path_hi)
+                )
+                and scan_id < :scan_id
+            """
+            self.u(sql, params)
 
-    def locations_scan_complete(self, root_folder: pathlib.Path) -> None:
+    def locations_scan_flush(
+        self,
+        scan_id: int,
+        files: list[ScannedFile],
+        folders: list[Folder],
+        unchanged_folder_paths: list[str],
+        checkpoint: list[str] | None = None,
+    ) -> None:
+        # The checkpoint lists the folders whose listings are not written yet, and is
+        # saved with the rows so a resumed scan never skips or repeats a folder
+        with self._transaction():
+            self._files_add_many(files, scan_id)
+            self._folders_add_many(folders, scan_id)
+            if checkpoint is not None:
+                sql = """
+                    update scans
+                    set checkpoint = :checkpoint
+                    where id = :scan_id
+                """
+                params = {
+                    "checkpoint": json.dumps(checkpoint),
+                    "scan_id": scan_id,
+                }
+                self.u(sql, params)
+            params = [
+                {"folder_path": f, "scan_id": scan_id} for f in unchanged_folder_paths
+            ]
+            sql = """
+                update folders
+                set scan_id = :scan_id
+                where folder_path = :folder_path
+            """
+            self.b(sql, params)
+            sql = """
+                update files
+                set scan_id = :scan_id
+                where folder_path = :folder_path
+            """
+            self.b(sql, params)
+
+    def locations_scan_start(
+        self, root_folder: pathlib.Path, quick: bool = False
+    ) -> int:
+        now = datetime.datetime.now(datetime.UTC).isoformat()
+        params = {
+            "root_folder": str(root_folder),
+            "last_scan_started_at": now,
+            "quick": quick,
+            # Until the first flush, resuming means listing the whole location again
+            "checkpoint": json.dumps([str(root_folder)]),
+            **_path_range(root_folder),
+        }
+        with self._transaction():
+            # A new scan replaces any unfinished one, which will not be resumed, so
+            # the folders it wrote are listed again as in locations_scan_cancel
+            sql = """
+                update folders
+                set mtime_ns = -1
+                where (
+                    folder_path = :root_folder
+                    or (folder_path >= :path_lo and folder_path < :path_hi)
+                )
+                and scan_id in (
+                    select id
+                    from scans
+                    where root_folder = :root_folder
+                    and completed_at is null and cancelled_at is null
+                )
+            """
+            self.u(sql, params)
+            sql = """
+                update scans
+                set cancelled_at = :last_scan_started_at, checkpoint = null
+                where root_folder = :root_folder
+                and completed_at is null and cancelled_at is null
+            """
+            self.u(sql, params)
+            sql = """
+                update locations set
+                    last_scan_started_at = :last_scan_started_at,
+                    last_scan_completed_at = null
+                where root_folder = :root_folder
+            """
+            self.u(sql, params)
+            sql = """
+                insert into scans (root_folder, started_at, quick, checkpoint)
+                values (:root_folder, :last_scan_started_at, :quick, :checkpoint)
+                returning id
+            """
+            return self.q(sql, params)[0]["id"]
+
+    def locations_schedule(
+        self, root_folder: pathlib.Path, scan_interval: int | None
+    ) -> None:
         sql = """
             update locations
-            set last_scan_completed_at = :last_scan_completed_at
+            set scan_interval = :scan_interval
             where root_folder = :root_folder
         """
         params = {
             "root_folder": str(root_folder),
-            "last_scan_completed_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            "scan_interval": scan_interval,
         }
         self.u(sql, params)
-        sql = """
-            delete from files
-            where instr(file_path, :root_folder) = 1
-            and scanned = 0
-        """
-        self.u(sql, params)
 
-    def locations_scan_start(self, root_folder: pathlib.Path) -> None:
+    def locations_sync(
+        self,
+        root_folder: pathlib.Path,
+        files: list[ScannedFile],
+        folders: list[Folder],
+        removed_folder_paths: list[str],
+    ) -> None:
+        # Applies a batch of watched changes. Each listed folder was read in full, so
+        # its rows this batch did not see are gone, as is everything below a removed
+        # folder. Nothing outside those folders is touched.
+        now = datetime.datetime.now(datetime.UTC).isoformat()
+        with self._transaction():
+            # The id comes from the scans sequence, so it sorts after any scan that
+            # is running, and the row is dropped so batches do not fill the table
+            sql = """
+                insert into scans (root_folder, started_at, completed_at)
+                values (:root_folder, :now, :now)
+                returning id
+            """
+            params = {
+                "root_folder": str(root_folder),
+                "now": now,
+            }
+            scan_id = self.q(sql, params)[0]["id"]
+            self.u("delete from scans where id = :scan_id", {"scan_id": scan_id})
+            self._files_add_many(files, scan_id)
+            self._folders_add_many(folders, scan_id)
+            gone = []
+            sql = """
+                select file_key, device, inode, size
+                from files
+                where folder_path = :folder_path
+                and scan_id < :scan_id
+            """
+            for f in folders:
+                params = {
+                    "folder_path": f.folder_path,
+                    "scan_id": scan_id,
+                }
+                gone.extend(self.q(sql, params))
+            sql = """
+                select file_key, device, inode, size
+                from files
+                where file_path >= :path_lo and file_path < :path_hi
+                and scan_id < :scan_id
+            """
+            for folder_path in removed_folder_paths:
+                params = {
+                    "scan_id": scan_id,
+                    **_path_range(folder_path),
+                }
+                gone.extend(self.q(sql, params))
+            gone_keys = {
+                (row["device"], row["inode"], row["size"]): row["file_key"]
+                for row in gone
+                if row["device"] is not None
+            }
+            sql = """
+                select
+                    file_key as new_key, file_path, suffix, folder_path,
+                    last_scanned_at, device, inode, size
+                from files
+                where first_scan_id = :scan_id
+            """
+            moves = []
+            for row in self.q(sql, {"scan_id": scan_id}):
+                old_key = gone_keys.pop(
+                    (row["device"], row["inode"], row["size"]), None
+                )
+                if old_key is not None:
+                    moves.append({**row, "old_key": old_key, "scan_id": scan_id})
+            self._files_apply_moves(moves)
+            moved_keys = {move["old_key"] for move in moves}
+            sql = """
+                delete from files
+                where file_key = :file_key
+            """
+            params = [
+                {"file_key": row["file_key"]}
+                for row in gone
+                if row["file_key"] not in moved_keys
+            ]
+            self.b(sql, params)
+            sql = """
+                delete from folders
+                where (
+                    folder_path = :root_folder
+                    or (folder_path >= :path_lo and folder_path < :path_hi)
+                )
+                and scan_id < :scan_id
+            """
+            for folder_path in removed_folder_paths:
+                params = {
+                    "root_folder": folder_path,
+                    "scan_id": scan_id,
+                    **_path_range(folder_path),
+                }
+                self.u(sql, params)
+
+    def locations_watch(self, root_folder: pathlib.Path, watched: bool) -> None:
         sql = """
-            update locations set
-                last_scan_started_at = :last_scan_started_at,
-                last_scan_completed_at = null
+            update locations
+            set watched = :watched
             where root_folder = :root_folder
         """
         params = {
             "root_folder": str(root_folder),
-            "last_scan_started_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            "watched": watched,
         }
         self.u(sql, params)
-        sql = """
-            update files
-            set scanned = 0
-            where instr(file_path, :root_folder) = 1
-        """
-        self.u(sql, params)
 
     def migrate(self) -> None:
         log.info(f"Database schema version is {self.version}")
@@ -349,19 +1304,339 @@ class VideoIndexModel(fort.SQLiteDatabase):
                 )
             """)
             self.version = 1
+        if self.version < 2:
+            log.info("Migrating to database schema version 2")
+            with self._transaction():
+                self.u("""
+                    create table folders (
+                        folder_path text primary key,
+                        mtime_ns integer not null,
+                        entry_count integer not null,
+                        scanned integer not null default 1
+                    )
+                """)
+                self.u("""
+                    alter table files add column folder_path text
+                """)
+                params = [
+                    {
+                        "file_path": row["file_path"],
+                        "folder_path": str(pathlib.Path(row["file_path"]).parent),
+                    }
+                    for row in self.q("select file_path from files")
+                ]
+                self.b(
+                    """
+                        update files
+                        set folder_path = :folder_path
+                        where file_path = :file_path
+                    """,
+                    params,
+                )
+                self.u("""
+                    create index files_folder_path on files (folder_path)
+                """)
+                self.version = 2
+        if self.version < 3:
+            log.info("Migrating to database schema version 3")
+            with self._transaction():
+                self.u("""
+                    create table scans (
+                        id integer primary key autoincrement,
+                        root_folder text not null,
+                        started_at text not null,
+                        completed_at text
+                    )
+                """)
+                for table_name in ("files", "folders"):
+                    self.u(f"""
+                        alter table {table_name} drop column scanned
+                    """)
+                    self.u(f"""
+                        alter table {table_name}
+                        add column scan_id integer not null default 0
+                    """)
+                self.version = 3
+        if self.version < 4:
+            log.info("Migrating to database schema version 4")
+            with self._transaction():
+                self.u("""
+                    create table files_v4 (
+                        file_key integer primary key,
+                        file_path text not null unique,
+                        id text not null,
+                        suffix text not null,
+                        folder_path text,
+                        scan_id integer not null default 0,
+                        last_scanned_at text not null,
+                        notes text not null default ''
+                    )
+                """)
+                self.u("""
+                    insert into files_v4 (
+                        file_path, id, suffix, folder_path, scan_id, last_scanned_at,
+                        notes
+                    )
+                    select
+                        file_path, id, suffix, folder_path, scan_id, last_scanned_at,
+                        notes
+                    from files
+                    order by file_path
+                """)
+                self.u("""
+                    drop table files
+                """)
+                self.u("""
+                    alter table files_v4 rename to files
+                """)
+                self.u("""
+                    create index files_folder_path on files (folder_path)
+                """)
+                self.u("""
+                    create virtual table files_fts using fts5 (
+                        file_path, notes,
+                        content = 'files', content_rowid = 'file_key',
+                        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                    )
+                """)
+                self.u("""
+                    create trigger files_fts_insert after insert on files begin
+                        insert into files_fts (rowid, file_path, notes)
+                        values (new.file_key, new.file_path, new.notes);
+                    end
+                """)
+                self.u("""
+                    create trigger files_fts_delete after delete on files begin
+                        insert into files_fts (files_fts, rowid, file_path, notes)
+                        values ('delete', old.file_key, old.file_path, old.notes);
+                    end
+                """)
+                self.u("""
+                    create trigger files_fts_update
+                    after update of file_path, notes on files begin
+                        insert into files_fts (files_fts, rowid, file_path, notes)
+                        values ('delete', old.file_key, old.file_path, old.notes);
+                        insert into files_fts (rowid, file_path, notes)
+                        values (new.file_key, new.file_path, new.notes);
+                    end
+                """)
+                self.u("""
+                    insert into files_fts (files_fts) values ('rebuild')
+                """)
+                self.version = 4
+        if self.version < 5:
+            log.info("Migrating to database schema version 5")
+            with self._transaction():
+                self.u("""
+                    create index files_id on files (id)
+                """)
+                self.u("""
+                    create index files_missing_notes on files (file_path, suffix)
+                    where notes = ''
+                """)
+                self.u("""
+                    create index files_suffix on files (suffix)
+                """)
+                self.version = 5
+        if self.version < 6:
+            log.info("Migrating to database schema version 6")
+            # Location membership in the triggers uses the same path range as
+            # _path_range, with the separator baked in
+            sep = os.sep
+            sep_next = chr(ord(sep) + 1)
+            with self._transaction():
+                self.u("""
+                    alter table suffixes
+                    add column file_count integer not null default 0
+                """)
+                self.u("""
+                    alter table locations
+                    add column file_count integer not null default 0
+                """)
+                self.u("""
+                    insert into suffixes (suffix, file_count)
+                    select suffix, count(*)
+                    from files
+                    where true
+                    group by suffix
+                    on conflict (suffix) do update set file_count = excluded.file_count
+                """)
+                for row in self.q("select root_folder from locations"):
+                    self._locations_count_files(row["root_folder"])
+                self.u("""
+                    drop index files_suffix
+                """)
+                self.u(f"""
+                    create trigger files_count_insert after insert on files begin
+                        insert into suffixes (suffix, file_count)
+                        values (new.suffix, 1)
+                        on conflict (suffix) do update set file_count = file_count + 1;
+                        update locations
+                        set file_count = file_count + 1
+                        where new.file_path > rtrim(root_folder, '{sep}') || '{sep}'
+                        and new.file_path < rtrim(root_folder, '{sep}') || '{sep_next}';
+                    end
+                """)  # noqa: S608
+                self.u(f"""
+                    create trigger files_count_delete after delete on files begin
+                        update suffixes
+                        set file_count = file_count - 1
+                        where suffix = old.suffix;
+                        update locations
+                        set file_count = file_count - 1
+                        where old.file_path > rtrim(root_folder, '{sep}') || '{sep}'
+                        and old.file_path < rtrim(root_folder, '{sep}') || '{sep_next}';
+                    end
+                """)  # noqa: S608
+                self.u(f"""
+                    create trigger files_count_update
+                    after update of file_path, suffix on files begin
+                        update suffixes
+                        set file_count = file_count - 1
+                        where suffix = old.suffix;
+                        insert into suffixes (suffix, file_count)
+                        values (new.suffix, 1)
+                        on conflict (suffix) do update set file_count = file_count + 1;
+                        update locations
+                        set file_count = file_count - 1
+                        where old.file_path > rtrim(root_folder, '{sep}') || '{sep}'
+                        and old.file_path < rtrim(root_folder, '{sep}') || '{sep_next}';
+                        update locations
+                        set file_count = file_count + 1
+                        where new.file_path > rtrim(root_folder, '{sep}') || '{sep}'
+                        and new.file_path < rtrim(root_folder, '{sep}') || '{sep_next}';
+                    end
+                """)  # noqa: S608
+                self.version = 6
+        if self.version < 7:
+            log.info("Migrating to database schema version 7")
+            with self._transaction():
+                self.u("""
+                    alter table files add column duration real
+                """)
+                self.u("""
+                    alter table files add column width integer
+                """)
+                self.u("""
+                    alter table files add column height integer
+                """)
+                self.u("""
+                    alter table files add column video_codec text
+                """)
+                self.version = 7
+        if self.version < 8:
+            log.info("Migrating to database schema version 8")
+            with self._transaction():
+                self.u("""
+                    alter table files add column bitrate integer
+                """)
+                self.u("""
+                    alter table files add column probe_size integer
+                """)
+                self.u("""
+                    alter table files add column probe_mtime_ns integer
+                """)
+                self.version = 8
+        if self.version < 9:
+            log.info("Migrating to database schema version 9")
+            with self._transaction():
+                self.u("""
+                    alter table files add column size integer
+                """)
+                self.u("""
+                    alter table files add column mtime_ns integer
+                """)
+                self.u("""
+                    alter table files add column partial_hash text
+                """)
+                self.u("""
+                    alter table files add column content_hash text
+                """)
+                self.u("""
+                    create index files_size_partial_hash on files (size, partial_hash)
+                """)
+                self.u("""
+                    create index files_content_hash on files (content_hash)
+                    where content_hash is not null
+                """)
+                self.version = 9
+        if self.version < 10:
+            log.info("Migrating to database schema version 10")
+            with self._transaction():
+                self.u("""
+                    alter table files add column device integer
+                """)
+                self.u("""
+                    alter table files add column inode integer
+                """)
+                self.u("""
+                    alter table files
+                    add column first_scan_id integer not null default 0
+                """)
+                self.u("""
+                    create index files_device_inode on files (device, inode)
+                """)
+                self.u("""
+                    create index files_first_scan_id on files (first_scan_id)
+                """)
+                self.version = 10
+        if self.version < 11:
+            log.info("Migrating to database schema version 11")
+            with self._transaction():
+                self.u("""
+                    alter table locations
+                    add column watched integer not null default 0
+                """)
+                self.version = 11
+        if self.version < 12:
+            log.info("Migrating to database schema version 12")
+            with self._transaction():
+                self.u("""
+                    alter table scans add column quick integer not null default 0
+                """)
+                self.u("""
+                    alter table scans add column checkpoint text
+                """)
+                self.u("""
+                    alter table scans add column cancelled_at text
+                """)
+                self.u("""
+                    create index scans_unfinished on scans (root_folder)
+                    where completed_at is null and cancelled_at is null
+                """)
+                self.version = 12
+        if self.version < 13:
+            log.info("Migrating to database schema version 13")
+            with self._transaction():
+                self.u("""
+                    alter table locations add column scan_interval integer
+                """)
+                self.version = 13
+        if self.version < 14:
+            log.info("Migrating to database schema version 14")
+            with self._transaction():
+                # Locations added over files that were already indexed started at 0
+                for row in self.q("select root_folder from locations"):
+                    self._locations_count_files(row["root_folder"])
+                self.version = 14
+
+    def scans_resumable(self) -> list[Scan]:
+        sql = """
+            select id, root_folder, quick, checkpoint
+            from scans
+            where completed_at is null and cancelled_at is null
+            and checkpoint is not null
+            order by id
+        """
+        return [Scan.from_row(row) for row in self.q(sql)]
 
     def suffixes_count(self) -> list[SuffixCount]:
         sql = """
-            with c as (
-                select suffix, count(*) file_count
-                from files
-                where length(suffix) > 0
-                group by suffix
-            )
-            select c.suffix, c.file_count, coalesce(s.enabled, 0) as enabled
-            from c
-            left join suffixes s on s.suffix = c.suffix
-            order by c.suffix
+            select suffix, file_count, enabled
+            from suffixes
+            where file_count > 0
+            and length(suffix) > 0
+            order by suffix
         """
         return [
             SuffixCount(row["suffix"], row["file_count"], bool(row["enabled"]))
@@ -412,5 +1687,11 @@ class VideoIndexModel(fort.SQLiteDatabase):
 
 
 def get_model() -> VideoIndexModel:
-    db_path = pathlib.Path(".local/video-index.db").resolve()
-    return VideoIndexModel(db_path)
+    # SQLite connections can only be used from the thread that created them, so each
+    # waitress and scheduler thread keeps its own connection open for reuse
+    model = getattr(_local, "model", None)
+    if model is None:
+        db_path = pathlib.Path(".local/video-index.db").resolve()
+        model = VideoIndexModel(db_path)
+        _local.model = model
+    return model
@@ -0,0 +1,307 @@
+import logging
+import os
+import struct
+import typing
+
+import video_index.budget as bu
+
+log = logging.getLogger(__name__)
+
+suffixes = {".m4v", ".mkv", ".mov", ".mp4", ".webm"}
+
+# Leaf boxes and elements are read into memory, anything larger is skipped
+max_leaf_size = 1024 * 1024
+
+mp4_containers = {b"mdia", b"minf", b"moov", b"stbl", b"trak"}
+mp4_codecs = {
+    b"av01": "AV1",
+    b"avc1": "H.264",
+    b"avc3": "H.264",
+    b"hev1": "HEVC",
+    b"hvc1": "HEVC",
+    b"mp4v": "MPEG-4",
+    b"vp09": "VP9",
+}
+
+mkv_codecs = {
+    "V_AV1": "AV1",
+    "V_MPEG4/ISO/AVC": "H.264",
+    "V_MPEGH/ISO/HEVC": "HEVC",
+    "V_MPEG4/ISO/ASP": "MPEG-4",
+    "V_VP8": "VP8",
+    "V_VP9": "VP9",
+}
+
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+
+
+class Metadata(typing.NamedTuple):
+    duration: float | None = None
+    width: int | None = None
+    height: int | None = None
+    video_codec: str | None = None
+
+
+def _mp4_boxes(
+    f: typing.BinaryIO, start: int, end: int
+) -> typing.Iterator[tuple[bytes, int, int]]:
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        bu.read_bytes.take(8)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            bu.read_bytes.take(8)
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size:
+            return
+        yield box_type, position + header_size, min(position + size, end)
+        position += size
+
+
+def _read(f: typing.BinaryIO, start: int, end: int) -> bytes:
+    if end - start > max_leaf_size:
+        return b""
+    bu.read_bytes.take(end - start)
+    f.seek(start)
+    return f.read(end - start)
+
+
+def _probe_mp4(f: typing.BinaryIO, size: int) -> Metadata:
+    duration = None
+    video = {}
+    tracks = []
+
+    def walk(start: int, end: int, track: dict | None) -> None:
+        nonlocal duration
+        for box_type, box_start, box_end in _mp4_boxes(f, start, end):
+            if box_type == b"trak":
+                tracks.append({})
+                walk(box_start, box_end, tracks[-1])
+            elif box_type in mp4_containers:
+                walk(box_start, box_end, track)
+            elif box_type == b"mvhd":
+                data = _read(f, box_start, box_end)
+                if data[:1] == b"\x01":
+                    timescale, length = struct.unpack_from(">IQ", data, 20)
+                else:
+                    timescale, length = struct.unpack_from(">II", data, 12)
+                if timescale and length:
+                    duration = length / timescale
+            elif track is not None and box_type == b"hdlr":
+                track["handler"] = _read(f, box_start, box_end)[8:12]
+            elif track is not None and box_type == b"stsd":
+                data = _read(f, box_start, box_end)
+                if len(data) >= 16 + 28:
+                    track["codec"] = data[12:16]
+                    track["width"], track["height"] = struct.unpack_from(
+                        ">HH", data, 16 + 24
+                    )
+
+    walk(0, size, None)
+    for track in tracks:
+        if track.get("handler") == b"vide" and "codec" in track:
+            video = track
+            break
+    codec = video.get("codec")
+    return Metadata(
+        duration,
+        video.get("width") or None,
+        video.get("height") or None,
+        mp4_codecs.get(codec, codec.decode("latin-1").strip()) if codec else None,
+    )
+
+
+def _vint(f: typing.BinaryIO, keep_marker: bool) -> tuple[int, int] | None:
+    bu.read_bytes.take(1)
+    first = f.read(1)
+    if not first:
+        return None
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first[0] & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        return None
+    value = first[0] if keep_marker else first[0] & (mask - 1)
+    bu.read_bytes.take(length - 1)
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        return None
+    for b in rest:
+        value = (value << 8) | b
+    return value, length
+
+
+def _ebml_elements(
+    f: typing.BinaryIO, start: int, end: int
+) -> typing.Iterator[tuple[int, int, int]]:
+    position = start
+    while position < end:
+        f.seek(position)
+        element_id = _vint(f, keep_marker=True)
+        element_size = _vint(f, keep_marker=False)
+        if element_id is None or element_size is None:
+            return
+        data_start = position + element_id[1] + element_size[1]
+        size = element_size[0]
+        # All ones means the size is unknown, which only happens for the segment and
+        # clusters, so treat it as running to the end of the parent
+        if size == (1 << (7 * element_size[1])) - 1:
+            size = end - data_start
+        yield element_id[0], data_start, min(data_start + size, end)
+        position = data_start + size
+
+
+def _uint(data: bytes) -> int:
+    return int.from_bytes(data, "big")
+
+
+def _probe_mkv(f: typing.BinaryIO, size: int) -> Metadata:
+    segment = None
+    for element_id, start, end in _ebml_elements(f, 0, size):
+        if element_id == SEGMENT:
+            segment = (start, end)
+            break
+    if segment is None:
+        return Metadata()
+    segment_start, segment_end = segment
+    timestamp_scale = 1000000
+    duration = None
+    video = {}
+    found = set()
+    seeks = {}
+
+    def parse_info(start: int, end: int) -> None:
+        nonlocal timestamp_scale, duration
+        for element_id, data_start, data_end in _ebml_elements(f, start, end):
+            if element_id == TIMESTAMP_SCALE:
+                timestamp_scale = _uint(_read(f, data_start, data_end))
+            elif element_id == DURATION:
+                data = _read(f, data_start, data_end)
+                if len(data) in (4, 8):
+                    duration = struct.unpack(">f" if len(data) == 4 else ">d", data)[0]
+
+    def parse_tracks(start: int, end: int) -> None:
+        for element_id, entry_start, entry_end in _ebml_elements(f, start, end):
+            if element_id != TRACK_ENTRY or video:
+                continue
+            track = {}
+            for child_id, data_start, data_end in _ebml_elements(
+                f, entry_start, entry_end
+            ):
+                if child_id == TRACK_TYPE:
+                    track["type"] = _uint(_read(f, data_start, data_end))
+                elif child_id == CODEC_ID:
+                    data = _read(f, data_start, data_end)
+                    track["codec"] = data.rstrip(b"\x00").decode("latin-1")
+                elif child_id == VIDEO:
+                    for video_id, video_start, video_end in _ebml_elements(
+                        f, data_start, data_end
+                    ):
+                        if video_id == PIXEL_WIDTH:
+                            track["width"] = _uint(_read(f, video_start, video_end))
+                        elif video_id == PIXEL_HEIGHT:
+                            track["height"] = _uint(_read(f, video_start, video_end))
+            if track.get("type") == 1:
+                video.update(track)
+
+    def parse_seek_head(start: int, end: int) -> None:
+        for element_id, seek_start, seek_end in _ebml_elements(f, start, end):
+            if element_id != SEEK:
+                continue
+            seek = {}
+            for child_id, data_start, data_end in _ebml_elements(
+                f, seek_start, seek_end
+            ):
+                seek[child_id] = _uint(_read(f, data_start, data_end))
+            if SEEK_ID in seek and SEEK_POSITION in seek:
+                seeks[seek[SEEK_ID]] = segment_start + seek[SEEK_POSITION]
+
+    parsers = {INFO: parse_info, TRACKS: parse_tracks}
+    for element_id, start, end in _ebml_elements(f, segment_start, segment_end):
+        if element_id == SEEK_HEAD:
+            parse_seek_head(start, end)
+        elif element_id in parsers:
+            parsers[element_id](start, end)
+            found.add(element_id)
+        elif element_id == CLUSTER:
+            # Media data starts here, so jump to anything that is only listed in the
+            # seek head instead of walking every cluster
+            for wanted in parsers.keys() - found:
+                if wanted in seeks:
+                    for sought_id, sought_start, sought_end in _ebml_elements(
+                        f, seeks[wanted], segment_end
+                    ):
+                        if sought_id == wanted:
+                            parsers[wanted](sought_start, sought_end)
+                        break
+            break
+        if found == parsers.keys():
+            break
+    codec = video.get("codec")
+    return Metadata(
+        duration * timestamp_scale / 1e9 if duration is not None else None,
+        video.get("width"),
+        video.get("height"),
+        mkv_codecs.get(codec, codec) if codec else None,
+    )
+
+
+def _probe(f: typing.BinaryIO, size: int) -> Metadata:
+    # Headers are small, but every box and element has one, so they are charged too
+    bu.read_bytes.take(12)
+    head = f.read(12)
+    if head[:4] == EBML.to_bytes(4, "big"):
+        return _probe_mkv(f, size)
+    if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide"):
+        return _probe_mp4(f, size)
+    return Metadata()
+
+
+def probe(file_path: str) -> Metadata:
+    with open(file_path, "rb") as f:
+        return _probe(f, os.fstat(f.fileno()).st_size)
+
+
+def probe_file(
+    file_path: str, size: int, mtime_ns: int
+) -> tuple[str, int, int, Metadata | None]:
+    # Runs in a worker process. The size and mtime returned are the ones the open
+    # file had when it was read, so metadata read from a file that changed since it
+    # was scanned is probed again once a scan records the change.
+    try:
+        with open(file_path, "rb") as f:
+            st = os.fstat(f.fileno())
+            try:
+                metadata = _probe(f, st.st_size)
+            except (OSError, struct.error, ValueError) as e:
+                log.debug(f"Could not probe {file_path}: {e}")
+                metadata = Metadata()
+    except OSError:
+        return file_path, size, mtime_ns, None
+    return file_path, st.st_size, st.st_mtime_ns, metadata
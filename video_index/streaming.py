@@ -0,0 +1,193 @@
+import datetime
+import email.utils
+import mimetypes
+import os
+import pathlib
+import secrets
+import typing
+
+import flask
+
+block_size = 256 * 1024
+max_ranges = 16
+
+
+class Plan(typing.NamedTuple):
+    status: int
+    headers: list[tuple[str, str]]
+    ranges: list[tuple[int, int]]
+    parts: list[bytes]
+    closing: bytes
+
+
+def _etag(st: os.stat_result) -> str:
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _http_date(value: str | None) -> datetime.datetime | None:
+    if value is None:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _not_modified(headers: typing.Mapping[str, str], st: os.stat_result) -> bool:
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return "*" in tags or _etag(st) in tags
+    if_modified_since = _http_date(headers.get("If-Modified-Since"))
+    if if_modified_since is None:
+        return False
+    return int(st.st_mtime) <= if_modified_since.timestamp()
+
+
+def _range_applies(headers: typing.Mapping[str, str], st: os.stat_result) -> bool:
+    if_range = headers.get("If-Range")
+    if if_range is None:
+        return True
+    if if_range.startswith(('"', "W/")):
+        return if_range == _etag(st)
+    if_range_date = _http_date(if_range)
+    return if_range_date is not None and int(st.st_mtime) == if_range_date.timestamp()
+
+
+def parse_ranges(value: str | None, size: int) -> list[tuple[int, int]] | None:
+    # Returns None when the header should be ignored and the whole file sent, or a
+    # list of (start, stop) pairs, empty when no range can be satisfied
+    if value is None:
+        return None
+    unit, _, specs = value.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        first, dash, last = spec.strip().partition("-")
+        if not dash:
+            return None
+        try:
+            if first:
+                start = int(first)
+                stop = int(last) + 1 if last else size
+                if last and stop <= start:
+                    return None
+            else:
+                suffix_length = int(last)
+                start = max(size - suffix_length, 0)
+                stop = size if suffix_length else 0
+        except ValueError:
+            return None
+        if start < size and start < stop:
+            ranges.append((start, min(stop, size)))
+    if len(ranges) > max_ranges:
+        return None
+    return ranges
+
+
+def plan(
+    method: str, headers: typing.Mapping[str, str], st: os.stat_result, mimetype: str
+) -> Plan:
+    size = st.st_size
+    validators = [
+        ("Accept-Ranges", "bytes"),
+        ("ETag", _etag(st)),
+        ("Last-Modified", email.utils.formatdate(st.st_mtime, usegmt=True)),
+    ]
+    if method in ("GET", "HEAD") and _not_modified(headers, st):
+        return Plan(304, validators, [], [], b"")
+    ranges = None
+    if _range_applies(headers, st):
+        ranges = parse_ranges(headers.get("Range"), size)
+    if ranges is None:
+        response_headers = [
+            *validators,
+            ("Content-Length", str(size)),
+            ("Content-Type", mimetype),
+        ]
+        return Plan(200, response_headers, [(0, size)], [], b"")
+    if not ranges:
+        response_headers = [
+            *validators,
+            ("Content-Length", "0"),
+            ("Content-Range", f"bytes */{size}"),
+        ]
+        return Plan(416, response_headers, [], [], b"")
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        response_headers = [
+            *validators,
+            ("Content-Length", str(stop - start)),
+            ("Content-Range", f"bytes {start}-{stop - 1}/{size}"),
+            ("Content-Type", mimetype),
+        ]
+        return Plan(206, response_headers, ranges, [], b"")
+    boundary = secrets.token_hex(16)
+    parts = [
+        (
+            f"\r\n--{boundary}\r\n"
+            f"Content-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n"
+        ).encode()
+        for start, stop in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    content_length = sum(len(p) for p in parts) + len(closing)
+    content_length += sum(stop - start for start, stop in ranges)
+    response_headers = [
+        *validators,
+        ("Content-Length", str(content_length)),
+        ("Content-Type", f"multipart/byteranges; boundary={boundary}"),
+    ]
+    return Plan(206, response_headers, ranges, parts, closing)
+
+
+def read_range(f: typing.BinaryIO, start: int, stop: int) -> typing.Iterator[bytes]:
+    f.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = f.read(min(block_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def _iter_plan(f: typing.BinaryIO, p: Plan) -> typing.Iterator[bytes]:
+    try:
+        if p.parts:
+            for part, (start, stop) in zip(p.parts, p.ranges, strict=True):
+                yield part
+                yield from read_range(f, start, stop)
+            yield p.closing
+        else:
+            start, stop = p.ranges[0]
+            yield from read_range(f, start, stop)
+    finally:
+        f.close()
+
+
+def send_file(file_path: pathlib.Path) -> flask.Response:
+    mimetype = mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+    f = file_path.open("rb")
+    try:
+        st = os.fstat(f.fileno())
+        p = plan(flask.request.method, flask.request.headers, st, mimetype)
+        if not p.ranges:
+            f.close()
+            return flask.Response(status=p.status, headers=p.headers)
+        file_wrapper = flask.request.environ.get("wsgi.file_wrapper")
+        if file_wrapper and not p.parts:
+            # A single range from a seeked file lets the server stream it with its own
+            # file wrapper instead of copying chunks through a worker thread
+            f.seek(p.ranges[0][0])
+            body = file_wrapper(f, block_size)
+        else:
+            body = _iter_plan(f, p)
+    except BaseException:
+        f.close()
+        raise
+    return flask.Response(
+        body, status=p.status, headers=p.headers, direct_passthrough=True
+    )
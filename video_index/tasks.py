@@ -1,26 +1,383 @@
+import collections
+import concurrent.futures
+import datetime
 import logging
+import multiprocessing
+import os
 import pathlib
+import threading
+import typing
+import zlib
 
 import apscheduler.schedulers.background
 
+import video_index.budget as bu
+import video_index.hashing as ha
 import video_index.models as m
+import video_index.probe as pr
+import video_index.writer as w
 
 log = logging.getLogger(__name__)
 scheduler = apscheduler.schedulers.background.BackgroundScheduler()
 
+scan_chunk_size = int(os.environ.get("SCAN_CHUNK_SIZE", "1000"))
+scan_workers = int(os.environ.get("SCAN_WORKERS", "8"))
+walk_listings_per_worker = 4
+probe_batch_size = 1000
+probe_workers = int(os.environ.get("PROBE_WORKERS", "4"))
+hash_batch_size = 1000
+hash_workers = int(os.environ.get("HASH_WORKERS", "4"))
 
-def scan_location(root_folder: pathlib.Path) -> None:
-    log.info(f"Scanning location {root_folder}")
-    model = m.get_model()
-    model.locations_scan_start(root_folder)
-    folders = [root_folder]
-    while folders:
-        folder = folders.pop()
-        log.debug(f"Scanning {folder}")
-        for item in folder.iterdir():
-            if item.is_dir():
-                folders.append(item)
-            else:
-                model.files_add(item)
-    model.locations_scan_complete(root_folder)
+# Root folders of scans that are queued or running, mapped to their cancel flag
+_scans: dict[str, threading.Event] = {}
+_scans_lock = threading.Lock()
+# Root folders of scans that are queued or running, mapped to their progress
+_progress: dict[str, m.ScanProgress] = {}
+
+
+class Listing(typing.NamedTuple):
+    folder: m.Folder
+    folders: list[str]
+    files: list[m.ScannedFile]
+    changed: bool
+
+
+def list_folder(
+    folder: str, previous: m.Folder | None, previous_folders: list[str]
+) -> Listing:
+    bu.scan_folders.take(1)
+    folders = []
+    files = []
+    try:
+        mtime_ns = os.stat(folder).st_mtime_ns
+        if previous and previous.mtime_ns == mtime_ns:
+            return Listing(previous, previous_folders, [], changed=False)
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    folders.append(entry.path)
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    files.append(m.ScannedFile(entry.path))
+                    continue
+                files.append(
+                    m.ScannedFile(
+                        entry.path, st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+                    )
+                )
+    except (FileNotFoundError, NotADirectoryError):
+        # Removed or replaced since its parent was listed, or since the checkpoint
+        # was saved. An empty listing lets the scan remove what was below it.
+        log.debug(f"Folder {folder} is gone")
+        return Listing(m.Folder(folder, -1, 0), [], [], changed=True)
+    entry_count = len(folders) + len(files)
+    return Listing(
+        m.Folder(folder, mtime_ns, entry_count), folders, files, changed=True
+    )
+
+
+def walk(
+    root_folder: pathlib.Path,
+    previous: dict[str, m.Folder] | None = None,
+    workers: int = scan_workers,
+    start: list[str] | None = None,
+) -> typing.Iterator[Listing]:
+    if previous is None:
+        previous = {}
+    previous_folders = collections.defaultdict(list)
+    for folder_path in previous:
+        previous_folders[os.path.dirname(folder_path)].append(folder_path)
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="walk"
+    )
+
+    def submit(folder: str) -> concurrent.futures.Future:
+        return executor.submit(
+            list_folder, folder, previous.get(folder), previous_folders[folder]
+        )
+
+    # Folders wait here until a listing slot is free, so a wide tree keeps at most a
+    # few listings per worker in memory rather than one future per folder
+    queued = collections.deque(start or [str(root_folder)])
+    listings = set()
+    try:
+        while queued or listings:
+            while queued and len(listings) < workers * walk_listings_per_worker:
+                listings.add(submit(queued.popleft()))
+            done, listings = concurrent.futures.wait(
+                listings, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for listing in done:
+                result = listing.result()
+                queued.extend(result.folders)
+                yield result
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def _checkpoint(pending: set[str]) -> list[str]:
+    # Folders below a pending folder are listed again when it is, so only the
+    # topmost pending folders are kept
+    return sorted(
+        f
+        for f in pending
+        if pending.isdisjoint(str(p) for p in pathlib.PurePath(f).parents)
+    )
+
+
+def request_scan(
+    root_folder: pathlib.Path, quick: bool = False, resume: m.Scan | None = None
+) -> bool:
+    key = str(root_folder)
+    with _scans_lock:
+        if key in _scans:
+            log.info(f"A scan of {root_folder} is already queued or running")
+            return False
+        _scans[key] = threading.Event()
+        # Shown until the scan starts, so it can be followed and cancelled already
+        progress = _progress[key] = m.ScanProgress(root_folder, quick)
+        progress.phase = "Queued"
+    scheduler.add_job(
+        scan_location, args=[root_folder, quick], kwargs={"resume": resume}
+    )
+    return True
+
+
+def schedule_scan(root_folder: pathlib.Path, scan_interval: int | None) -> None:
+    job_id = f"rescan {root_folder}"
+    if scan_interval is None:
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+        return
+    seconds = scan_interval * 60
+    # Runs fall on fixed slots counted from the epoch, offset by a hash of the path,
+    # so locations with the same interval start at different times and keep their
+    # slots across restarts
+    offset = zlib.crc32(str(root_folder).encode()) % seconds
+    scheduler.add_job(
+        request_scan,
+        "interval",
+        args=[root_folder, True],
+        id=job_id,
+        replace_existing=True,
+        seconds=seconds,
+        start_date=datetime.datetime.fromtimestamp(offset, datetime.UTC),
+    )
+    log.info(f"Scanning {root_folder} every {scan_interval} minutes")
+
+
+def cancel_scan(root_folder: pathlib.Path) -> bool:
+    with _scans_lock:
+        cancelled = _scans.get(str(root_folder))
+    if cancelled is None:
+        return False
+    log.info(f"Cancelling scan of {root_folder}")
+    cancelled.set()
+    return True
+
+
+def scan_progress(root_folder: pathlib.Path) -> m.ScanProgress | None:
+    return _progress.get(str(root_folder))
+
+
+def scan_location(
+    root_folder: pathlib.Path,
+    quick: bool = False,
+    chunk_size: int = scan_chunk_size,
+    resume: m.Scan | None = None,
+) -> None:
+    key = str(root_folder)
+    with _scans_lock:
+        cancelled = _scans.setdefault(key, threading.Event())
+        progress = _progress[key] = m.ScanProgress(root_folder, quick)
+    try:
+        _scan_location(root_folder, quick, chunk_size, resume, cancelled, progress)
+    finally:
+        with _scans_lock:
+            _scans.pop(key, None)
+            _progress.pop(key, None)
+
+
+def _scan_location(
+    root_folder: pathlib.Path,
+    quick: bool,
+    chunk_size: int,
+    resume: m.Scan | None,
+    cancelled: threading.Event,
+    progress: m.ScanProgress,
+) -> None:
+    if cancelled.is_set():
+        log.info(f"Scan of {root_folder} was cancelled before it started")
+        return
+    # A location that is missing as a whole, like an unmounted drive, is left as it
+    # is rather than scanned as empty
+    if not root_folder.is_dir():
+        log.warning(f"Location {root_folder} is not a folder, not scanning it")
+        return
+    if resume:
+        log.info(f"Resuming scan of {root_folder} at {len(resume.checkpoint)} folders")
+        scan_id = resume.id
+        start = resume.checkpoint
+    else:
+        log.info(f"Scanning location {root_folder} ({'quick' if quick else 'full'})")
+        scan_id = w.submit(
+            w.BULK, m.VideoIndexModel.locations_scan_start, root_folder, quick
+        ).result()
+        start = [str(root_folder)]
+    # Read after the start, which resets the folders of any scan it replaces
+    previous = m.get_model().folders_list(root_folder) if quick else None
+    # Folders that were queued for listing but whose listings are not written yet
+    pending = set(start)
+    progress.queued = len(start)
+    listed = []
+    files = []
+    folders = []
+    unchanged_folder_paths = []
+    flush = None
+    flush_file_count = 0
+    for listing in walk(root_folder, previous, start=start):
+        if cancelled.is_set():
+            break
+        progress.listed(
+            listing.folder.folder_path, len(listing.files), len(listing.folders)
+        )
+        pending.update(listing.folders)
+        listed.append(listing.folder.folder_path)
+        if listing.changed:
+            log.debug(f"Scanning {listing.folder.folder_path}")
+            files.extend(listing.files)
+            folders.append(listing.folder)
+        else:
+            log.debug(f"Skipping unchanged {listing.folder.folder_path}")
+            unchanged_folder_paths.append(listing.folder.folder_path)
+        if len(files) + len(folders) + len(unchanged_folder_paths) >= chunk_size:
+            # Keep at most one chunk queued behind the one being written
+            if flush:
+                flush.result()
+                progress.files_written += flush_file_count
+            pending.difference_update(listed)
+            flush = w.submit(
+                w.BULK,
+                m.VideoIndexModel.locations_scan_flush,
+                scan_id,
+                files,
+                folders,
+                unchanged_folder_paths,
+                _checkpoint(pending),
+            )
+            flush_file_count = len(files)
+            listed = []
+            files = []
+            folders = []
+            unchanged_folder_paths = []
+    if flush:
+        flush.result()
+        progress.files_written += flush_file_count
+    if cancelled.is_set():
+        w.submit(
+            w.BULK, m.VideoIndexModel.locations_scan_cancel, root_folder, scan_id
+        ).result()
+        log.info(f"Cancelled scan of {root_folder}")
+        return
+    w.submit(
+        w.BULK,
+        m.VideoIndexModel.locations_scan_flush,
+        scan_id,
+        files,
+        folders,
+        unchanged_folder_paths,
+    ).result()
+    progress.files_written += len(files)
+    progress.current_folder = None
+    progress.phase = "Removing missing files"
+    w.submit(
+        w.BULK, m.VideoIndexModel.locations_scan_complete, root_folder, scan_id
+    ).result()
     log.info(f"Done scanning location {root_folder}")
+    progress.phase = "Reading video metadata"
+    probe_location(root_folder)
+    if cancelled.is_set():
+        return
+    progress.phase = "Hashing files"
+    hash_location(root_folder)
+
+
+def probe_location(root_folder: pathlib.Path, workers: int = probe_workers) -> None:
+    log.info(f"Reading video metadata in {root_folder}")
+    model = m.get_model()
+    probed = 0
+    after = ""
+    # Forking a process that runs the web server and writer threads is unsafe
+    context = multiprocessing.get_context("spawn")
+    # Each worker process reads within its share of the budget
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, context, bu.set_read_rate, (bu.read_bytes.rate / workers,)
+    ) as executor:
+        while True:
+            candidates = model.files_probe_candidates(
+                root_folder, pr.suffixes, after, probe_batch_size
+            )
+            if not candidates:
+                break
+            after = candidates[-1][0]
+            metadata = [
+                {
+                    "file_path": file_path,
+                    "probe_size": size,
+                    "probe_mtime_ns": mtime_ns,
+                    "bitrate": round(size * 8 / result.duration)
+                    if result.duration
+                    else None,
+                    **result._asdict(),
+                }
+                for file_path, size, mtime_ns, result in executor.map(
+                    pr.probe_file, *zip(*candidates, strict=True), chunksize=16
+                )
+                if result is not None
+            ]
+            if metadata:
+                w.submit(
+                    w.BULK, m.VideoIndexModel.files_update_metadata, metadata
+                ).result()
+                probed += len(metadata)
+    log.info(f"Read video metadata for {probed} files in {root_folder}")
+
+
+def _write_batches(fn: typing.Callable[..., object], rows: list[dict]) -> None:
+    for i in range(0, len(rows), hash_batch_size):
+        w.submit(w.BULK, fn, rows[i : i + hash_batch_size]).result()
+
+
+def hash_location(root_folder: pathlib.Path, workers: int = hash_workers) -> None:
+    log.info(f"Hashing files in {root_folder}")
+    model = m.get_model()
+    # Hashing is bound by disk reads and hashlib releases the GIL, so threads give
+    # the I/O concurrency without the cost of processes
+    with concurrent.futures.ThreadPoolExecutor(workers, "hash") as executor:
+        # Only files whose size collides are read at all, and only files whose
+        # partial hash also collides are read in full. Scans clear the hashes of files
+        # whose size or mtime changed, and the hash functions skip files that changed
+        # since.
+        candidates = model.files_partial_hash_candidates(root_folder)
+        hashes = [
+            {
+                "file_path": result[0],
+                "partial_hash": result[1],
+                "content_hash": result[2],
+            }
+            for result in executor.map(ha.partial_hash, *zip(*candidates, strict=True))
+            if result is not None
+        ]
+        _write_batches(m.VideoIndexModel.files_update_hashes, hashes)
+        log.info(f"Read partial hashes for {len(hashes)} files in {root_folder}")
+
+        candidates = model.files_content_hash_candidates(root_folder)
+        hashes = [
+            {"file_path": result[0], "partial_hash": None, "content_hash": result[1]}
+            for result in executor.map(ha.content_hash, *zip(*candidates, strict=True))
+            if result is not None
+        ]
+        _write_batches(m.VideoIndexModel.files_update_hashes, hashes)
+        log.info(f"Read content hashes for {len(hashes)} files in {root_folder}")
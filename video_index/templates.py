@@ -1,9 +1,52 @@
+import pathlib
+import re
+import typing
+
 import flask
 import htpy
+import markupsafe
 
 import video_index.models as m
 import video_index.versions as v
 
+# Placeholders in fragments that htpy renders once and that are filled in per use
+placeholder_pattern = re.compile(r"__fragment_(\w+?)__")
+# File ids are url-safe tokens, which url_for leaves as they are
+url_safe_id = re.compile(r"[A-Za-z0-9_-]+")
+_fragments: dict[tuple[str, str], "_Fragment"] = {}
+
+
+class _Fragment:
+    # Rendered once and split into literal parts, so each use only joins those parts
+    # with values that are already escaped
+    def __init__(self, node: htpy.Node) -> None:
+        parts = placeholder_pattern.split(str(htpy.fragment[node]))
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+
+    def render(self, **values: str) -> str:
+        chunks = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:], strict=True):
+            chunks.append(values[name])
+            chunks.append(literal)
+        return "".join(chunks)
+
+
+class _CardPlaceholder(m.File):
+    __slots__ = ()
+
+    @property
+    def details(self) -> markupsafe.Markup:
+        return _placeholder("details")
+
+
+class _DetailsPlaceholder(m.File):
+    __slots__ = ()
+
+    @property
+    def details_text(self) -> markupsafe.Markup:
+        return _placeholder("text")
+
 
 def _base(content: htpy.Node) -> htpy.Element:
     return htpy.html(lang="en")[
@@ -50,6 +93,34 @@ def _base(content: htpy.Node) -> htpy.Element:
     ]
 
 
+def _card(file: m.File) -> str:
+    if not url_safe_id.fullmatch(file.id):
+        return str(file.card)
+    details_text = file.details_text
+    if details_text:
+        details = _fragment(
+            "details", lambda: _placeholder_file(_DetailsPlaceholder).details
+        ).render(text=markupsafe.escape(details_text))
+    else:
+        details = ""
+    return _fragment("card", lambda: _placeholder_file(_CardPlaceholder).card).render(
+        details=details,
+        id=file.id,
+        name=markupsafe.escape(file.file_path.name),
+        notes=markupsafe.escape(file.notes or "(No notes)"),
+        parent=markupsafe.escape(str(file.file_path.parent)),
+    )
+
+
+def _fragment(name: str, build: typing.Callable[[], htpy.Node]) -> _Fragment:
+    # Keyed by script root, because that is part of every url_for result
+    key = (flask.request.script_root, name)
+    fragment = _fragments.get(key)
+    if fragment is None:
+        fragment = _fragments[key] = _Fragment(build())
+    return fragment
+
+
 def _nav(active_page: str = "files") -> htpy.Element:
     pages = [
         {
@@ -67,6 +138,11 @@ def _nav(active_page: str = "files") -> htpy.Element:
             "href": flask.url_for("suffixes"),
             "active": active_page == "suffixes",
         },
+        {
+            "title": "Duplicates",
+            "href": flask.url_for("duplicates"),
+            "active": active_page == "duplicates",
+        },
     ]
     page_elements = []
     for p in pages:
@@ -82,6 +158,69 @@ def _nav(active_page: str = "files") -> htpy.Element:
     ]
 
 
+def _page(active_page: str, content: htpy.Node) -> str:
+    # The shell and nav only change with the active page
+    shell = _fragment(
+        f"page {active_page}",
+        lambda: _base([_nav(active_page), _placeholder("content")]),
+    )
+    return shell.render(content=str(htpy.fragment[content]))
+
+
+def _placeholder(name: str) -> markupsafe.Markup:
+    # Only ever called with the literal names used in this module
+    return markupsafe.Markup(f"__fragment_{name}__")  # noqa: S704
+
+
+def _placeholder_file(cls: type[m.File]) -> m.File:
+    return cls(
+        pathlib.Path("__fragment_parent__", "__fragment_name__"),
+        "__fragment_id__",
+        "__fragment_notes__",
+    )
+
+
+def duplicates() -> str:
+    return _page(
+        "duplicates",
+        [
+            htpy.div(
+                "#duplicate-groups.pt-3.row",
+                hx_post=flask.url_for("duplicates_groups"),
+                hx_trigger="load",
+            ),
+        ],
+    )
+
+
+def duplicates_list(groups: list[m.DuplicateGroup]) -> str:
+    if len(groups) < 1:
+        return str(
+            htpy.div(".col.pb-3")[
+                "No duplicates found. Duplicates are detected when a ",
+                htpy.a(href=flask.url_for("locations"))["location"],
+                " is scanned.",
+            ]
+        )
+
+    cards = []
+    last_hash = ""
+    for i, g in enumerate(groups):
+        if i < 20:
+            cards.append(g.card)
+            last_hash = g.content_hash
+        else:
+            cards.append(
+                htpy.div(
+                    ".col-12.pb-3",
+                    hx_post=flask.url_for("duplicates_groups", after=last_hash),
+                    hx_swap="outerHTML",
+                    hx_trigger="revealed",
+                )
+            )
+    return str(htpy.fragment[cards])
+
+
 def favicon() -> str:
     svg_path = (
         "M0 1a1 1 0 0 1 1-1h14a1 1 0 0 1 1 1v14a1 1 0 0 1-1 1H1a1 1 0 0 1-1-1zm4 0v6h8V"
@@ -119,19 +258,25 @@ def files_list(files: list[m.File]) -> str:
     last_path = ""
     for i, f in enumerate(files):
         if i < 5:
-            cards.append(f.card)
+            cards.append(_card(f))
             last_path = f.file_path
         else:
             cards.append(
-                htpy.div(
-                    ".col.pb-3",
-                    hx_include="#card-filters",
-                    hx_post=flask.url_for("files_cards", after=last_path),
-                    hx_swap="outerHTML",
-                    hx_trigger="revealed",
+                str(
+                    htpy.div(
+                        ".col.pb-3",
+                        hx_include="#card-filters",
+                        hx_post=flask.url_for("files_cards", after=last_path),
+                        hx_swap="outerHTML",
+                        hx_trigger="revealed",
+                    )
                 )
             )
-    return str(htpy.fragment[cards])
+    return "".join(cards)
+
+
+def files_player(file: m.File) -> str:
+    return str(file.player)
 
 
 def files_update_notes(file: m.File) -> str:
@@ -139,46 +284,44 @@ def files_update_notes(file: m.File) -> str:
 
 
 def index() -> str:
-    return str(
-        _base(
-            [
-                _nav(active_page="files"),
-                htpy.form(
-                    "#card-filters.align-items-center.pt-3.row",
-                    hx_target="#video-cards",
-                )[
-                    htpy.div(".col-auto")[
+    return _page(
+        "files",
+        [
+            htpy.form(
+                "#card-filters.align-items-center.pt-3.row",
+                hx_target="#video-cards",
+            )[
+                htpy.div(".col-auto")[
+                    htpy.input(
+                        ".form-control.mb-2",
+                        hx_post=flask.url_for("files_cards"),
+                        hx_trigger="search, keyup changed delay:300ms",
+                        name="q",
+                        placeholder="Search...",
+                        type="search",
+                    )
+                ],
+                htpy.div(".col-auto")[
+                    htpy.div(".form-check.form-switch.mb-2")[
                         htpy.input(
-                            ".form-control.mb-2",
+                            "#missing-notes-only.form-check-input",
                             hx_post=flask.url_for("files_cards"),
-                            hx_trigger="search, keyup changed delay:300ms",
-                            name="q",
-                            placeholder="Search...",
-                            type="search",
-                        )
-                    ],
-                    htpy.div(".col-auto")[
-                        htpy.div(".form-check.form-switch.mb-2")[
-                            htpy.input(
-                                "#missing-notes-only.form-check-input",
-                                hx_post=flask.url_for("files_cards"),
-                                name="missing-notes-only",
-                                type="checkbox",
-                            ),
-                            htpy.label(".form-check-Label", for_="missing-notes-only")[
-                                "Only show files missing notes"
-                            ],
-                        ]
-                    ],
+                            name="missing-notes-only",
+                            type="checkbox",
+                        ),
+                        htpy.label(".form-check-Label", for_="missing-notes-only")[
+                            "Only show files missing notes"
+                        ],
+                    ]
                 ],
-                htpy.div(
-                    "#video-cards.pt-3.row.row-cols-1.row-cols-sm-2.row-cols-lg-3.row-cols-xxl-4",
-                    hx_include="#card-filters",
-                    hx_post=flask.url_for("files_cards"),
-                    hx_trigger="load",
-                ),
-            ]
-        )
+            ],
+            htpy.div(
+                "#video-cards.pt-3.row.row-cols-1.row-cols-sm-2.row-cols-lg-3.row-cols-xxl-4",
+                hx_include="#card-filters",
+                hx_post=flask.url_for("files_cards"),
+                hx_trigger="load",
+            ),
+        ],
     )
 
 
@@ -193,42 +336,49 @@ def locations(locs: list[m.Location]) -> str:
                 ]
             ]
         ]
-    return str(
-        _base(
-            [
-                _nav(active_page="locations"),
-                htpy.form(
-                    ".g-1.pt-3.row",
-                    action=flask.url_for("locations_add"),
-                    method="post",
-                )[
-                    htpy.div(".col-auto")[
-                        htpy.input(
-                            ".form-control",
-                            name="root-folder",
-                            required=True,
-                            type="text",
-                        )
-                    ],
-                    htpy.div(".col-auto")[
-                        htpy.button(".btn.btn-outline-primary", type="submit")[
-                            htpy.i(".bi-folder-plus"),
-                            " Add location",
-                        ]
-                    ],
+    return _page(
+        "locations",
+        [
+            htpy.form(
+                ".g-1.pt-3.row",
+                action=flask.url_for("locations_add"),
+                method="post",
+            )[
+                htpy.div(".col-auto")[
+                    htpy.input(
+                        ".form-control",
+                        name="root-folder",
+                        required=True,
+                        type="text",
+                    )
                 ],
-                htpy.div(".pt-3.row")[
-                    htpy.div(".col")[
-                        htpy.table(".align-middle.d-block.table")[
-                            m.Location.thead, htpy.tbody[trs]
-                        ]
+                htpy.div(".col-auto")[
+                    htpy.button(".btn.btn-outline-primary", type="submit")[
+                        htpy.i(".bi-folder-plus"),
+                        " Add location",
                     ]
                 ],
-            ]
-        )
+            ],
+            htpy.div(".pt-3.row")[
+                htpy.div(".col")[
+                    htpy.table(".align-middle.d-block.table")[
+                        m.Location.thead, htpy.tbody[trs]
+                    ]
+                ]
+            ],
+        ],
     )
 
 
+def locations_progress(
+    root_folder: pathlib.Path, progress: m.ScanProgress | None
+) -> str:
+    if progress is None:
+        # Without a scan the poller waits until one is requested
+        return str(m.ScanProgress.poller(root_folder, "scan-requested from:body"))
+    return str(progress.div)
+
+
 def suffixes(suffix_counts: list[m.SuffixCount]) -> str:
     if suffix_counts:
         content = htpy.table(".align-middle.d-block.table")[
@@ -240,11 +390,9 @@ def suffixes(suffix_counts: list[m.SuffixCount]) -> str:
             htpy.a(href=flask.url_for("locations"))["location"],
             " first.",
         ]
-    return str(
-        _base(
-            [
-                _nav(active_page="suffixes"),
-                htpy.div(".pt-3.row")[htpy.div(".col")[content]],
-            ]
-        )
+    return _page(
+        "suffixes",
+        [
+            htpy.div(".pt-3.row")[htpy.div(".col")[content]],
+        ],
     )
@@ -1,7 +1,7 @@
 import json
 import pathlib
 
-package_json = pathlib.Path("package.json")
+package_json = pathlib.Path(__file__).parent.parent / "package.json"
 with package_json.open() as f:
     data = json.load(f)
 
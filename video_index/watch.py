@@ -0,0 +1,274 @@
+import ctypes
+import errno
+import logging
+import os
+import pathlib
+import struct
+import threading
+import time
+
+import video_index.models as m
+import video_index.tasks as ta
+import video_index.writer as w
+
+log = logging.getLogger(__name__)
+
+# Changes are applied once no new event has arrived for debounce seconds, but never
+# later than max_delay seconds after the first change in a batch
+debounce = 0.5
+max_delay = 5.0
+poll_interval = float(os.environ.get("WATCH_POLL_INTERVAL", "10"))
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+watch_mask = (
+    IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+)
+event_header = struct.Struct("iIII")
+
+_lock = threading.Lock()
+_changed = threading.Condition(_lock)
+_dirty: set[str] = set()
+_first_change = 0.0
+_last_change = 0.0
+# Watched root folders, mapped to "inotify" or "poll"
+_roots: dict[str, str] = {}
+_wds: dict[int, str] = {}
+_folder_wds: dict[str, int] = {}
+_libc: ctypes.CDLL | None = None
+_inotify_fd: int | None = None
+_threads: list[threading.Thread] = []
+
+
+def _below(folder_path: str, root_folder: str) -> bool:
+    return folder_path == root_folder or folder_path.startswith(
+        os.path.join(root_folder, "")
+    )
+
+
+def _start() -> None:
+    # Called with _lock held
+    global _inotify_fd, _libc
+    if _threads:
+        return
+    try:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        fd = _libc.inotify_init1(os.O_CLOEXEC)
+    except (AttributeError, OSError):
+        fd = -1
+    targets = [_apply_changes, _poll]
+    if fd < 0:
+        log.info("inotify is not available, watched locations will be polled")
+    else:
+        _inotify_fd = fd
+        targets.append(_read_events)
+    for target in targets:
+        thread = threading.Thread(target=target, name=f"watch{target.__name__}")
+        thread.daemon = True
+        thread.start()
+        _threads.append(thread)
+
+
+def _add_watch(folder_path: str) -> None:
+    # Called with _lock held
+    wd = _libc.inotify_add_watch(_inotify_fd, os.fsencode(folder_path), watch_mask)
+    if wd < 0:
+        error = ctypes.get_errno()
+        if error == errno.ENOSPC:
+            raise OSError(error, "inotify watch limit reached")
+        return
+    _wds[wd] = folder_path
+    _folder_wds[folder_path] = wd
+
+
+def _remove_watches(folder_paths: list[str]) -> None:
+    # Called with _lock held
+    for watched_path in list(_folder_wds):
+        if any(_below(watched_path, f) for f in folder_paths):
+            wd = _folder_wds.pop(watched_path)
+            _wds.pop(wd, None)
+            _libc.inotify_rm_watch(_inotify_fd, wd)
+
+
+def _watch_folders(root_folder: str, folder_paths: list[str]) -> None:
+    with _lock:
+        if _roots.get(root_folder) != "inotify":
+            return
+        try:
+            for folder_path in folder_paths:
+                _add_watch(folder_path)
+        except OSError as e:
+            log.warning(f"Polling {root_folder} instead: {e}")
+            _remove_watches([root_folder])
+            _roots[root_folder] = "poll"
+
+
+def _mark(folder_paths: set[str]) -> None:
+    global _first_change, _last_change
+    if not folder_paths:
+        return
+    with _changed:
+        now = time.monotonic()
+        if not _dirty:
+            _first_change = now
+        _last_change = now
+        _dirty.update(folder_paths)
+        _changed.notify()
+
+
+def _changed_folders(root_folder: str) -> set[str]:
+    changed = set()
+    for folder in m.get_model().folders_list(pathlib.Path(root_folder)).values():
+        try:
+            mtime_ns = os.stat(folder.folder_path).st_mtime_ns
+        except OSError:
+            changed.add(os.path.dirname(folder.folder_path))
+            continue
+        if mtime_ns != folder.mtime_ns:
+            changed.add(folder.folder_path)
+    return changed
+
+
+def _read_events() -> None:
+    while True:
+        data = os.read(_inotify_fd, 64 * 1024)
+        folder_paths = set()
+        overflow = False
+        offset = 0
+        with _lock:
+            while offset < len(data):
+                wd, mask, _, length = event_header.unpack_from(data, offset)
+                offset += event_header.size + length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & IN_IGNORED:
+                    folder_path = _wds.pop(wd, None)
+                    if folder_path and _folder_wds.get(folder_path) == wd:
+                        del _folder_wds[folder_path]
+                elif wd in _wds:
+                    folder_paths.add(_wds[wd])
+            roots = [r for r, mode in _roots.items() if mode == "inotify"]
+        if overflow:
+            # Events were dropped, so fall back to checking folder mtimes once
+            log.warning("inotify queue overflowed, checking watched folders")
+            for root_folder in roots:
+                folder_paths.update(_changed_folders(root_folder))
+        _mark(folder_paths)
+
+
+def _poll() -> None:
+    while True:
+        time.sleep(poll_interval)
+        with _lock:
+            roots = [r for r, mode in _roots.items() if mode == "poll"]
+        for root_folder in roots:
+            _mark(_changed_folders(root_folder))
+
+
+def _apply_changes() -> None:
+    while True:
+        with _changed:
+            while not _dirty:
+                _changed.wait()
+            while True:
+                deadline = min(_last_change + debounce, _first_change + max_delay)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                _changed.wait(timeout)
+            folder_paths = set(_dirty)
+            _dirty.clear()
+            roots = list(_roots)
+        for root_folder in roots:
+            batch = {f for f in folder_paths if _below(f, root_folder)}
+            if not batch:
+                continue
+            try:
+                sync(root_folder, batch)
+            except Exception:
+                log.exception(f"Could not apply changes in {root_folder}")
+
+
+def sync(root_folder: str, folder_paths: set[str]) -> None:
+    model = m.get_model()
+    files = []
+    folders = []
+    removed = []
+    added = []
+    for folder_path in sorted(folder_paths):
+        if any(_below(folder_path, r) for r in removed):
+            continue
+        try:
+            listing = ta.list_folder(folder_path, None, [])
+        except OSError:
+            if folder_path != root_folder:
+                removed.append(folder_path)
+            continue
+        known = {
+            f
+            for f in model.folders_list(pathlib.Path(folder_path))
+            if os.path.dirname(f) == folder_path
+        }
+        removed.extend(sorted(known.difference(listing.folders)))
+        added.extend(f for f in listing.folders if f not in known)
+        files.extend(listing.files)
+        folders.append(listing.folder)
+    with _lock:
+        if _roots.get(root_folder) == "inotify":
+            _remove_watches(removed)
+    # Folders that are new to the index are walked in full, they have nothing to
+    # compare against
+    added_folders = []
+    for folder_path in added:
+        for listing in ta.walk(pathlib.Path(folder_path)):
+            files.extend(listing.files)
+            folders.append(listing.folder)
+            added_folders.append(listing.folder.folder_path)
+    log.info(
+        f"Applying changes in {root_folder}: {len(folders)} folders listed, "
+        f"{len(removed)} removed"
+    )
+    w.submit(
+        w.BULK,
+        m.VideoIndexModel.locations_sync,
+        pathlib.Path(root_folder),
+        files,
+        folders,
+        removed,
+    ).result()
+    if added_folders:
+        _watch_folders(root_folder, added_folders)
+        # Anything created in a new folder before its watch was added is picked up by
+        # listing it once more
+        with _lock:
+            mode = _roots.get(root_folder)
+        if mode == "inotify":
+            _mark(set(added_folders))
+
+
+def watch(root_folder: pathlib.Path) -> None:
+    root = str(root_folder)
+    with _lock:
+        if root in _roots:
+            return
+        _start()
+        _roots[root] = "poll" if _inotify_fd is None else "inotify"
+    known = m.get_model().folders_list(root_folder)
+    _watch_folders(root, [root, *known])
+    log.info(f"Watching {root} ({_roots.get(root)})")
+    # Catch up on anything that changed since the last scan
+    _mark(_changed_folders(root) if known else {root})
+
+
+def unwatch(root_folder: pathlib.Path) -> None:
+    root = str(root_folder)
+    with _lock:
+        if _roots.pop(root, None) == "inotify":
+            _remove_watches([root])
+    log.info(f"Stopped watching {root}")
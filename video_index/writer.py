@@ -0,0 +1,50 @@
+import concurrent.futures
+import itertools
+import logging
+import queue
+import threading
+import time
+import typing
+
+import video_index.metrics as mx
+import video_index.models as m
+
+log = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+_counter = itertools.count()
+_lock = threading.Lock()
+_queue = queue.PriorityQueue()
+_thread: threading.Thread | None = None
+
+
+def _run() -> None:
+    model = m.get_model()
+    while True:
+        _, _, submitted, future, fn, args = _queue.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        start = time.perf_counter()
+        mx.write_wait_seconds.observe(start - submitted, fn=fn.__name__)
+        try:
+            future.set_result(fn(model, *args))
+        except Exception as e:
+            log.exception(f"Write {fn.__name__} failed")
+            future.set_exception(e)
+        mx.write_seconds.observe(time.perf_counter() - start, fn=fn.__name__)
+
+
+def submit(
+    priority: int, fn: typing.Callable[..., object], *args: object
+) -> concurrent.futures.Future:
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="writer", daemon=True)
+            _thread.start()
+    future = concurrent.futures.Future()
+    # The counter keeps writes of equal priority in submission order
+    _queue.put((priority, next(_counter), time.perf_counter(), future, fn, args))
+    return future